@@ -0,0 +1,309 @@
+import math
+import importlib.util
+import numpy as np
+
+'''
+    Compute backends for the interference kernels of simulation.MichelsonSimulation.
+
+    A backend evaluates the intensity of every screenPoint-spectralLine combination
+    (nonlocalIntensity and localIntensity), all backends take the same inputs and give
+    the same output up to floating-point rounding (~1e-12 relative):
+        'numpy'   - plain NumPy array operations, always available
+        'numexpr' - the per-wavelength part (phase, cosine, intensity formula) as one
+                    multi-threaded numexpr expression, when numexpr is installed
+        'numba'   - one fused, parallel loop over screen points, without any full-size
+                    temporaries, when numba is installed
+    getBackend('auto') picks the fastest installed one, in the order numba, numexpr, numpy.
+
+    The fused backends always work in float64; with float32 precision (see
+    MichelsonSimulation.setPrecision), or with a visibility factor (see
+    MichelsonSimulation.setAntialiasing), they hand the work over to the NumPy kernels.
+'''
+
+enhance_factor = 1e3
+
+# get intervals between every screen point and every source, screen is (P, 3) and sources is (..., M, 3),
+# the output is np.array of shape (..., P, M)
+def getIntervalArray(screen, sources):
+    difference = screen[:, np.newaxis, :] - sources[..., np.newaxis, :, :]
+    return np.sqrt(np.sum(difference * difference, axis=-1))
+
+# wavenumbers (in 1/cm) of the wavelengths (in nm=10^{-7}cm) of spectral lines
+def getWavenumber(wavelength):
+    return (10 ** 7) * 2 * math.pi / wavelength
+
+class NumpyBackend:
+    """The default backend, evaluating the kernels with NumPy array operations.
+
+    The geometry is computed once per source position, and only the phase
+    difference is evaluated per wavelength, in place to save full-size
+    temporaries.
+
+    """
+
+    name = 'numpy'
+
+    def cosPhase(self, pathDifference, wavelength, precision=np.float64):
+        """cos of the phase difference, for path differences (..., N) in cm.
+
+        pathDifference is a new float64 array and is overwritten. The phase,
+        about 1e7*2*pi*delta/lambda (up to ~1e6 rad), is always formed in
+        float64, where its rounding error is ~1e-10 rad; in float32 it would
+        be ~0.1 rad, thus for float32 precision it is first reduced to
+        [0, 2*pi) in float64, leaving an error of ~1e-6 rad in the float32
+        cosine. The output is in the working precision.
+
+        """
+
+        phase = pathDifference
+        phase *= getWavenumber(wavelength)                    # derive phase differnce
+        if precision is np.float32:
+            np.remainder(phase, 2 * math.pi, out=phase)
+            phase = phase.astype(np.float32)
+        np.cos(phase, out=phase)
+        return phase
+
+    def nonlocalIntensity(self, screen, position_S1, position_S2, wavelength, source_intensity, position_index,
+                          precision=np.float64, visibility=None):
+        """Intensity of every screenPoint-spectralLine combination for non-local interference.
+
+        screen is (P, 3), position_S1 and position_S2 are (..., M, 3), where
+        optional leading axes are the frames of a sweep. The other inputs
+        are as given by MichelsonSimulation.getImageSourceArray, the output
+        has shape (..., P, N). visibility, if given, scales the interference
+        (cosine) term of every combination, shape (P, N), e.g. to box-filter
+        fringes finer than a pixel.
+
+        """
+
+        # calculate interval between source and screen straightly, once per source position
+        interval1 = getIntervalArray(screen, position_S1)
+        interval2 = getIntervalArray(screen, position_S2)
+        intensity1 = 1/(interval1 ** 2)
+        intensity2 = 1/(interval2 ** 2)
+        incoherent = intensity1 + intensity2
+        coherent = 2 * np.sqrt(intensity1 * intensity2)
+
+        intensity = self.cosPhase((interval1 - interval2)[..., position_index], wavelength, precision)
+        if visibility is not None:
+            intensity *= visibility
+        intensity *= coherent[..., position_index]
+        intensity += incoherent[..., position_index]
+        intensity *= source_intensity * enhance_factor
+        return intensity
+
+    def localIntensity(self, direction, position_S1, position_S2, wavelength, source_intensity, position_index,
+                       precision=np.float64, visibility=None):
+        """Intensity of every screenPoint-spectralLine combination for local interference.
+
+        The same as nonlocalIntensity, except that the screen points are
+        given by their unit directions (P, 3), i.e. the directions of the
+        parallel light.
+
+        """
+
+        intervalVector = position_S1 - position_S2    # derive vector from one coherent image source to the other
+        pathDifference = np.einsum('pk,...mk->...pm', direction, intervalVector)      # once per source position
+
+        intensity = self.cosPhase(pathDifference[..., position_index], wavelength, precision)
+        if visibility is not None:
+            intensity *= visibility
+        intensity += 1
+        intensity *= 2 * source_intensity
+        return intensity
+
+    def __repr__(self):
+        return '{}()'.format(type(self).__name__)
+
+class NumexprBackend(NumpyBackend):
+    """A backend evaluating the per-wavelength part of the kernels with numexpr.
+
+    The geometry is still computed with NumPy once per source position,
+    then the phase, its cosine and the intensity formula are evaluated in
+    one multi-threaded pass, without the intermediate full-size arrays.
+
+    """
+
+    name = 'numexpr'
+
+    def __init__(self):
+        import numexpr    # raises ImportError when numexpr is not installed
+
+    def nonlocalIntensity(self, screen, position_S1, position_S2, wavelength, source_intensity, position_index,
+                          precision=np.float64, visibility=None):
+        if precision is not np.float64 or visibility is not None:
+            return NumpyBackend.nonlocalIntensity(self, screen, position_S1, position_S2, wavelength,
+                                                  source_intensity, position_index, precision, visibility)
+        import numexpr
+        interval1 = getIntervalArray(screen, position_S1)
+        interval2 = getIntervalArray(screen, position_S2)
+        intensity1 = 1/(interval1 ** 2)
+        intensity2 = 1/(interval2 ** 2)
+        local_dict = {'difference': (interval1 - interval2)[..., position_index],
+                      'coherent': (2 * np.sqrt(intensity1 * intensity2))[..., position_index],
+                      'incoherent': (intensity1 + intensity2)[..., position_index],
+                      'wavenumber': getWavenumber(wavelength),
+                      'scale': source_intensity * enhance_factor}
+        return numexpr.evaluate('(cos(difference * wavenumber) * coherent + incoherent) * scale',
+                                local_dict=local_dict, out=local_dict['difference'])
+
+    def localIntensity(self, direction, position_S1, position_S2, wavelength, source_intensity, position_index,
+                       precision=np.float64, visibility=None):
+        if precision is not np.float64 or visibility is not None:
+            return NumpyBackend.localIntensity(self, direction, position_S1, position_S2, wavelength,
+                                               source_intensity, position_index, precision, visibility)
+        import numexpr
+        pathDifference = np.einsum('pk,...mk->...pm', direction, position_S1 - position_S2)
+        local_dict = {'difference': pathDifference[..., position_index],
+                      'wavenumber': getWavenumber(wavelength),
+                      'scale': 2 * source_intensity}
+        return numexpr.evaluate('(cos(difference * wavenumber) + 1) * scale', local_dict=local_dict,
+                                out=local_dict['difference'])
+
+# jit-compiled kernels of NumbaBackend, built once per process
+_numba_kernels = {}
+
+def _buildNumbaKernels():
+    import numba
+
+    # out is (F, P, N), screen is (P, 3), position_S1 and position_S2 are (F, M, 3); the lines of position m
+    # are line_order[line_start[m]:line_start[m + 1]], so the geometry of each position is computed once
+    # into scalars and the loop body allocates nothing
+    @numba.njit(parallel=True, cache=True)
+    def nonlocalKernel(screen, position_S1, position_S2, wavenumber, scale, line_order, line_start, out):
+        n_frames, n_points, n_lines = out.shape
+        n_positions = position_S1.shape[1]
+        for task in numba.prange(n_frames * n_points):
+            f, p = task // n_points, task % n_points
+            for m in range(n_positions):
+                dx1 = screen[p, 0] - position_S1[f, m, 0]
+                dy1 = screen[p, 1] - position_S1[f, m, 1]
+                dz1 = screen[p, 2] - position_S1[f, m, 2]
+                dx2 = screen[p, 0] - position_S2[f, m, 0]
+                dy2 = screen[p, 1] - position_S2[f, m, 1]
+                dz2 = screen[p, 2] - position_S2[f, m, 2]
+                interval1 = np.sqrt(dx1 * dx1 + dy1 * dy1 + dz1 * dz1)
+                interval2 = np.sqrt(dx2 * dx2 + dy2 * dy2 + dz2 * dz2)
+                intensity1 = 1 / (interval1 * interval1)
+                intensity2 = 1 / (interval2 * interval2)
+                difference = interval1 - interval2
+                coherent = 2 * np.sqrt(intensity1 * intensity2)
+                incoherent = intensity1 + intensity2
+                for j in range(line_start[m], line_start[m + 1]):
+                    n = line_order[j]
+                    out[f, p, n] = (np.cos(difference * wavenumber[n]) * coherent + incoherent) * scale[n]
+
+    # out is (F, P, N), direction is (P, 3), intervalVector is (F, M, 3), the lines are grouped as above
+    @numba.njit(parallel=True, cache=True)
+    def localKernel(direction, intervalVector, wavenumber, scale, line_order, line_start, out):
+        n_frames, n_points, n_lines = out.shape
+        n_positions = intervalVector.shape[1]
+        for task in numba.prange(n_frames * n_points):
+            f, p = task // n_points, task % n_points
+            for m in range(n_positions):
+                pathDifference = (direction[p, 0] * intervalVector[f, m, 0] + direction[p, 1] * intervalVector[f, m, 1]
+                                  + direction[p, 2] * intervalVector[f, m, 2])
+                for j in range(line_start[m], line_start[m + 1]):
+                    n = line_order[j]
+                    out[f, p, n] = (np.cos(pathDifference * wavenumber[n]) + 1) * scale[n]
+
+    _numba_kernels['nonlocal'] = nonlocalKernel
+    _numba_kernels['local'] = localKernel
+
+class NumbaBackend(NumpyBackend):
+    """A backend evaluating the kernels as fused loops compiled by numba.
+
+    Every screen point (of every frame) is handled in one parallel loop,
+    computing the geometry per source position and then the intensity of
+    each spectral line straight into the output, so no full-size
+    temporaries are made. The kernels are compiled on the first call in
+    every process, not when the backend is made.
+
+    """
+
+    name = 'numba'
+
+    def __init__(self):
+        if importlib.util.find_spec('numba') is None:
+            raise ImportError('numba is not installed')
+
+    # the compiled kernels, built on first call in every process (e.g. after being unpickled in a worker)
+    def getKernels(self):
+        if not _numba_kernels:
+            _buildNumbaKernels()
+        return _numba_kernels
+
+    # broadcast the image sources to (F, M, 3) for the kernels, the output is '(S1, S2, leading shape)'
+    def frames(self, position_S1, position_S2):
+        position_S1, position_S2 = np.broadcast_arrays(np.asarray(position_S1, dtype=float),
+                                                       np.asarray(position_S2, dtype=float))
+        leading = position_S1.shape[:-2]
+        n_positions = position_S1.shape[-2]
+        return (np.ascontiguousarray(position_S1.reshape(-1, n_positions, 3)),
+                np.ascontiguousarray(position_S2.reshape(-1, n_positions, 3)), leading)
+
+    # group the spectral lines by source position for the kernels, the output is '(line_order, line_start)'
+    def lineGroups(self, position_index, n_positions):
+        position_index = np.asarray(position_index, dtype=np.int64)
+        line_order = np.argsort(position_index, kind='stable')
+        line_start = np.searchsorted(position_index[line_order], np.arange(n_positions + 1))
+        return line_order.astype(np.int64), line_start.astype(np.int64)
+
+    def nonlocalIntensity(self, screen, position_S1, position_S2, wavelength, source_intensity, position_index,
+                          precision=np.float64, visibility=None):
+        if precision is not np.float64 or visibility is not None:
+            return NumpyBackend.nonlocalIntensity(self, screen, position_S1, position_S2, wavelength,
+                                                  source_intensity, position_index, precision, visibility)
+        position_S1, position_S2, leading = self.frames(position_S1, position_S2)
+        out = np.empty((len(position_S1), len(screen), np.size(wavelength)))
+        self.getKernels()['nonlocal'](np.ascontiguousarray(screen, dtype=float), position_S1, position_S2,
+                                      getWavenumber(wavelength), source_intensity * enhance_factor,
+                                      *self.lineGroups(position_index, position_S1.shape[1]), out)
+        return out.reshape(leading + out.shape[1:])
+
+    def localIntensity(self, direction, position_S1, position_S2, wavelength, source_intensity, position_index,
+                       precision=np.float64, visibility=None):
+        if precision is not np.float64 or visibility is not None:
+            return NumpyBackend.localIntensity(self, direction, position_S1, position_S2, wavelength,
+                                               source_intensity, position_index, precision, visibility)
+        position_S1, position_S2, leading = self.frames(position_S1, position_S2)
+        out = np.empty((len(position_S1), len(direction), np.size(wavelength)))
+        self.getKernels()['local'](np.ascontiguousarray(direction, dtype=float), position_S1 - position_S2,
+                                   getWavenumber(wavelength), 2 * source_intensity,
+                                   *self.lineGroups(position_index, position_S1.shape[1]), out)
+        return out.reshape(leading + out.shape[1:])
+
+backends = {'numpy': NumpyBackend, 'numexpr': NumexprBackend, 'numba': NumbaBackend}
+
+'''
+    Get a backend by name, or the fastest installed one for 'auto';
+    an ImportError listing the installed ones is raised when the backend asked for is not installed
+'''
+def getBackend(name='auto'):
+    if name == 'auto':
+        for name in ('numba', 'numexpr'):
+            try:
+                return backends[name]()
+            except ImportError:
+                pass
+        return NumpyBackend()
+    if name not in backends:
+        raise ValueError('backend must be one of {}'.format(('auto',) + tuple(backends)))
+    try:
+        return backends[name]()
+    except ImportError as error:
+        raise ImportError('{}, the installed backends are {}'.format(
+            error, ('auto',) + tuple(availableBackends()))) from error
+
+'''
+    Get the names of the installed backends
+'''
+def availableBackends():
+    names = []
+    for name in backends:
+        try:
+            backends[name]()
+        except ImportError:
+            continue
+        names.append(name)
+    return names
@@ -0,0 +1,292 @@
+import os
+import sys
+import json
+import hashlib
+import argparse
+import multiprocessing
+import numpy as np
+
+import simulation
+import simulation_corr
+from screen import Screen
+from source import CorrelatedSource, ExtendedSource
+from pattern import reduceSpectralLines, pattern_outputs
+from visual import channelsToImage
+from backend import availableBackends
+
+'''
+    Headless batch rendering of a scene, or a sweep of mirror M1 positions or M2 directions.
+
+    The scene is a JSON file like:
+        {
+            "engine": "simulation",                 (or "simulation_corr")
+            "mode": "nonlocal",                     (or "local")
+            "screen": {"shape": [100, 100], "size": [5, 5], "distance": 30},
+            "mirrors": {"G": [[0, 0, 0], [-1, 1, 0]],
+                        "M1": [[0, 100, 0], [0, -1, 0]],
+                        "M2": [[100, 0, 0], [-1, 1e-3, 0]]},
+            "sources": [{"position": [-20, 0, 0], "wavelength": 589, "intensity": 0.3},
+                        {"position": [-20, 0, 0], "spectrum": [...81 values on 380-780 nm...]},
+                        {"type": "extended", "shape": "disk", "extent": 0.3, "position": [-20, 0, 0],
+                         "wavelength": 589, "intensity": 0.3, "n_samples": 64, "seed": 0},
+                        {"type": "correlated", "shape": "cross", "position": [-20, 0, 0], "wavelength": 589}],
+            "sweep": {"mirror": "M1", "start": [0, 100, 0], "stop": [0, 100.001, 0], "steps": 1000},
+            "png": true, "colored": true, "npz": "total"
+        }
+    "screen" is optional (the default screen of the mode), and so is "sweep" (a single frame);
+    a sweep gives either "start", "stop" and "steps" (inclusive) or an explicit list of "values".
+    Extended sources need the "simulation" engine, correlated sources ("cross", "disk" or
+    "gaussian", with the arguments of CorrelatedSource) the "simulation_corr" engine.
+    "npz" is the output kind saved per frame ('spectrum', 'xyz' or 'total', or null for none),
+    "png" saves the image as renderImage gives it. The "simulation" engine also takes "backend", "precision"
+    and "antialiasing", e.g. {"threshold": 1.57, "max_factor": 8} (see MichelsonSimulation.setAntialiasing).
+
+    Frames are rendered in a process pool, each output is written to a temporary file and then
+    renamed, so a frame is finished once all its outputs exist. A manifest.json, written before the
+    frames, lists the frames and their outputs together with a hash of the scene. Rerunning the same
+    command resumes an interrupted run by skipping finished frames; if the scene has changed since
+    (or there is no manifest), the outputs of the old manifest are removed and every frame is rendered again.
+
+    Usage:
+        python batch.py scene.json --output-dir out --workers 8
+'''
+
+'''
+    Build a MichelsonSimulation of the engine of scene, set up as described by scene;
+    backend, if given, is used instead of the "backend" of scene
+'''
+def buildSimulation(scene, backend=None):
+    engine = scene.get('engine', 'simulation')
+    if engine not in ('simulation', 'simulation_corr'):
+        raise ValueError('engine must be simulation or simulation_corr')
+    module = simulation if engine == 'simulation' else simulation_corr
+    sim = module.MichelsonSimulation()
+    if engine == 'simulation':
+        sim.setBackend(backend or scene.get('backend', 'auto'))
+        sim.setPrecision(scene.get('precision', 'float64'))
+        if scene.get('antialiasing') is not None:
+            sim.setAntialiasing(**scene['antialiasing'])
+
+    mirrors = scene['mirrors']
+    sim.initialMirrorG(*mirrors['G'])
+    sim.initialMirrorM1(*mirrors['M1'])
+    sim.initialMirrorM2(*mirrors['M2'])
+
+    for description in scene['sources']:
+        insertSource(sim, engine, description)
+
+    mode = scene.get('mode', 'nonlocal')
+    if mode not in ('local', 'nonlocal'):
+        raise ValueError('mode must be local or nonlocal')
+    screen = None
+    if 'screen' in scene:
+        defaults = Screen.localScreen() if mode == 'local' else Screen.nonlocalScreen()
+        screen = Screen(scene['screen'].get('shape', defaults.shape), scene['screen'].get('size', defaults.size),
+                        scene['screen'].get('distance', defaults.distance),
+                        scene['screen'].get('normal', defaults.normal), scene['screen'].get('row_axis', defaults.row_axis))
+    if mode == 'local':
+        sim.changeToLocal(screen)
+    else:
+        sim.changeToNonlocal(screen)
+    return sim
+
+'''
+    Insert the source of a scene description into sim
+'''
+def insertSource(sim, engine, description):
+    kind = description.get('type', 'spectrum' if 'spectrum' in description else 'point')
+    position = description['position']
+    if 'spectrum' in description:
+        wavelengths = description.get('wavelengths', simulation.spec_wavelengths)
+        intensities = description['spectrum']
+    else:
+        wavelengths = description.get('wavelengths', description.get('wavelength'))
+        intensities = description.get('intensities', description.get('intensity', 1))
+
+    if kind == 'point':
+        sim.insertSource(position, wavelengths, source_intensity=intensities)
+    elif kind == 'spectrum':
+        sim.insertSpecSource(position, intensities, wavelengths=wavelengths)
+    elif kind == 'extended':
+        if engine != 'simulation':
+            raise ValueError('extended sources need the simulation engine')
+        sim.insertExtendedSource(ExtendedSource(position, wavelengths, intensities, description['shape'],
+                                                description['extent'], description.get('n_samples', 64),
+                                                description.get('seed', 0)))
+    elif kind == 'correlated':
+        if engine != 'simulation_corr':
+            raise ValueError('correlated sources need the simulation_corr engine')
+        shape = description.get('shape', 'cross')
+        if shape not in ('cross', 'disk', 'gaussian'):
+            raise ValueError('correlated source shape must be cross, disk or gaussian')
+        arguments = {name: value for name, value in description.items()
+                     if name not in ('type', 'shape', 'position', 'wavelength', 'wavelengths', 'intensity',
+                                     'intensities', 'spectrum')}
+        sim.insertCorrelatedSource(getattr(CorrelatedSource, shape)(position, wavelengths, intensities, **arguments))
+    else:
+        raise ValueError('unknown source type {!r}'.format(kind))
+
+'''
+    Get the frames of scene as a list of (mirror, value), with mirror None for a single frame
+'''
+def getFrames(scene):
+    sweep = scene.get('sweep')
+    if sweep is None:
+        return [(None, None)]
+    mirror = sweep.get('mirror', 'M1')
+    if mirror not in ('M1', 'M2'):
+        raise ValueError('sweep mirror must be M1 or M2')
+    if 'values' in sweep:
+        values = np.array(sweep['values'], dtype=float).reshape(-1, 3)
+    else:
+        values = np.linspace(sweep['start'], sweep['stop'], int(sweep['steps'])).reshape(-1, 3)
+    return [(mirror, value.tolist()) for value in values]
+
+'''
+    Get the stable hash (a hex string) of a scene description
+'''
+def getSceneHash(scene):
+    return hashlib.sha256(json.dumps(scene, sort_keys=True, separators=(',', ':')).encode()).hexdigest()
+
+'''
+    Load the manifest of output_dir, or None if there is none (or it is broken)
+'''
+def loadManifest(output_dir):
+    try:
+        with open(os.path.join(output_dir, 'manifest.json')) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+'''
+    Save manifest as manifest.json in output_dir
+'''
+def saveManifest(output_dir, manifest):
+    temporary = os.path.join(output_dir, 'manifest.tmp.json')
+    with open(temporary, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(temporary, os.path.join(output_dir, 'manifest.json'))
+
+'''
+    Get the output files of frame index in output_dir, as a dict of format to path
+'''
+def getOutputPaths(scene, output_dir, index):
+    paths = {}
+    if scene.get('png', True):
+        paths['png'] = os.path.join(output_dir, 'frame_{:06d}.png'.format(index))
+    if scene.get('npz') is not None:
+        paths['npz'] = os.path.join(output_dir, 'frame_{:06d}.npz'.format(index))
+    return paths
+
+# state of a worker process, set once by _initWorker
+_worker = {}
+
+def _initWorker(scene, backend):
+    _worker['scene'] = scene
+    _worker['scene_hash'] = getSceneHash(scene)
+    _worker['simulation'] = buildSimulation(scene, backend)
+
+def _renderFrame(job):
+    index, mirror, value, paths = job
+    scene, sim = _worker['scene'], _worker['simulation']
+    if mirror == 'M1':
+        sim.setMirrorM1(value)
+    elif mirror == 'M2':
+        sim.setMirrorM2(value)
+    height, width = sim.screen.shape
+    colored = scene.get('colored', True)
+    image_output = 'xyz' if colored else 'total'
+    npz_output = scene.get('npz')
+
+    # one kernel pass: the output asked for, or the spectrum when two different ones are needed
+    outputs = set(([image_output] if 'png' in paths else []) + ([npz_output] if 'npz' in paths else []))
+    compute_output = outputs.pop() if len(outputs) == 1 else 'spectrum'
+    values, wavelengths = sim.screenIntensity(output=compute_output)
+    def getValues(output):
+        if output == compute_output:
+            return values.reshape(height, width, -1)
+        return reduceSpectralLines(values, wavelengths, output).reshape(height, width, -1)
+
+    if 'npz' in paths:
+        temporary = paths['npz'][:-len('.npz')] + '.tmp.npz'
+        np.savez_compressed(temporary, values=getValues(npz_output), wavelengths=wavelengths, output=npz_output,
+                            mirror=str(mirror), value=np.array(value if value is not None else [], dtype=float),
+                            scene_hash=_worker['scene_hash'])
+        os.replace(temporary, paths['npz'])
+    if 'png' in paths:
+        import matplotlib
+        matplotlib.use('Agg')
+        from matplotlib import image as mpimg
+        temporary = paths['png'][:-len('.png')] + '.tmp.png'
+        image = channelsToImage(getValues(image_output), colored)
+        mpimg.imsave(temporary, np.clip(image, 0, 1) if colored else image, format='png')
+        os.replace(temporary, paths['png'])
+    return index
+
+'''
+    Render all frames of scene into output_dir with a pool of worker processes
+    (os.cpu_count() by default), skipping the finished frames of the same scene unless force.
+    backend overrides the "backend" of scene; it does not change the results, so frames rendered
+    with another backend are still reused.
+    The output is the manifest, which is also saved as manifest.json in output_dir.
+'''
+def runBatch(scene, output_dir, workers=None, force=False, log=None, backend=None):
+    if workers is None:
+        workers = os.cpu_count() or 1
+    os.makedirs(output_dir, exist_ok=True)
+    frames = getFrames(scene)
+    if scene.get('npz') not in pattern_outputs + (None,):
+        raise ValueError('npz must be one of {} or null'.format(pattern_outputs))
+    buildSimulation(scene, backend)            # fail early on a bad scene, before starting any worker
+
+    # frames in output_dir are only reused when they were rendered from the same scene
+    scene_hash = getSceneHash(scene)
+    previous = loadManifest(output_dir)
+    if previous is None or previous.get('scene_hash') != scene_hash:
+        if previous is not None:
+            if log is not None:
+                log('the scene has changed since the last run, rendering every frame again')
+            for entry in previous.get('frames', []):
+                for name in entry.get('files', {}).values():
+                    path = os.path.join(output_dir, name)
+                    if os.path.exists(path):
+                        os.remove(path)
+        force = True
+
+    jobs, entries = [], []
+    for index, (mirror, value) in enumerate(frames):
+        paths = getOutputPaths(scene, output_dir, index)
+        entries.append({'index': index, 'mirror': mirror, 'value': value,
+                        'files': {kind: os.path.basename(path) for kind, path in paths.items()}})
+        if force or not all(os.path.exists(path) for path in paths.values()):
+            jobs.append((index, mirror, value, paths))
+
+    manifest = {'scene': scene, 'scene_hash': scene_hash, 'frames': entries}
+    saveManifest(output_dir, manifest)
+
+    if log is not None:
+        log('{} frame(s), {} already finished, {} to render'.format(len(frames), len(frames) - len(jobs), len(jobs)))
+    if jobs:
+        with multiprocessing.Pool(min(workers, len(jobs)), initializer=_initWorker, initargs=(scene, backend)) as pool:
+            for done, index in enumerate(pool.imap_unordered(_renderFrame, jobs), 1):
+                if log is not None:
+                    log('[{}/{}] frame {}'.format(done, len(jobs), index))
+    return manifest
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Render a RealMichelson scene or mirror sweep without the GUI.')
+    parser.add_argument('scene', help='JSON scene description, see the notes in batch.py')
+    parser.add_argument('--output-dir', default='batch_output', help='directory of the frames and manifest.json')
+    parser.add_argument('--workers', type=int, help='worker processes, os.cpu_count() by default')
+    parser.add_argument('--force', action='store_true', help='render finished frames again instead of skipping them')
+    parser.add_argument('--backend', choices=('auto',) + tuple(availableBackends()),
+                        help='compute backend of the "simulation" engine instead of the one of the scene')
+    args = parser.parse_args(argv)
+
+    with open(args.scene) as f:
+        scene = json.load(f)
+    runBatch(scene, args.output_dir, args.workers, args.force, log=print, backend=args.backend)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,165 @@
+import sys
+import json
+import time
+import argparse
+import platform
+import tracemalloc
+import numpy as np
+
+import simulation
+import simulation_corr
+from backend import getBackend, availableBackends
+from screen import Screen
+from source import CorrelatedSource
+from visual import RGBConverter, renderImage
+
+'''
+    Benchmark suite for RealMichelson.
+
+    Every scenario is a fixed, seeded setup of simulation.MichelsonSimulation or
+    simulation_corr.MichelsonSimulation in local or non-local mode, with a monochromatic,
+    81-bin spectral or correlated source, on a given grid size; the colour path
+    (visual.RGBConverter) is timed on its own, and so is the direct-to-xyz colour render
+    (visual.renderImage). For each scenario we report the best wall
+    time over some repeats and the peak memory traced by tracemalloc.
+
+    Usage:
+        python benchmark.py --output bench.json
+        python benchmark.py --baseline bench.json --output new.json
+'''
+
+white_spec = np.ones(np.size(simulation.spec_wavelengths)) / 400
+
+'''
+    Build a simulation of the given engine ('simulation' or 'simulation_corr'),
+    mode ('local' or 'nonlocal'), source ('mono', 'spectral' or 'correlated') and grid size,
+    the kernels of simulation go through the given compute backend (see backend.py)
+'''
+def buildScenario(engine, mode, source, size, backend='auto'):
+    module = simulation if engine == 'simulation' else simulation_corr
+    sim = module.MichelsonSimulation()
+    if engine == 'simulation':
+        sim.setBackend(backend)
+    sim.initialMirrorG([0, 0, 0], [-1, 1, 0])
+    sim.initialMirrorM1([0, 100, 0], [0, -1, 0])
+    if mode == 'local':
+        sim.initialMirrorM2([100, 0, 0], [-1, 2.5e-6, 0])
+    else:
+        sim.initialMirrorM2([100, 0, 0], [-1, 1e-4, 0])
+
+    if source == 'mono':
+        sim.insertSource([-20, 0, 0], 589, source_intensity=0.3)
+    elif source == 'spectral':
+        sim.insertSpecSource([-20, 0, 0], white_spec)
+    elif source == 'correlated':
+        sim.insertCorrelatedSource(CorrelatedSource.disk([-20, 0, 0], 589, 0.3, radius=0.5, n_subsources=64, seed=0))
+
+    if mode == 'local':
+        sim.changeToLocal(Screen.localScreen((size, size)))
+    else:
+        sim.changeToNonlocal(Screen.nonlocalScreen((size, size)))
+    return sim
+
+def renderPattern(sim):
+    if sim.islocalInterference:
+        return sim.localInterference()
+    return sim.nonlocalInterference()
+
+'''
+    Get the list of scenarios as (name, setup, run), where setup() builds the input
+    (not timed) and run(input) is the timed work
+'''
+def getScenarios(sizes, backend='auto'):
+    scenarios = []
+    for size in sizes:
+        for engine, sources in (('simulation', ('mono', 'spectral')),
+                                ('simulation_corr', ('mono', 'spectral', 'correlated'))):
+            for mode in ('nonlocal', 'local'):
+                for source in sources:
+                    name = '{}/{}/{}/{}'.format(engine, mode, source, size)
+                    setup = (lambda engine=engine, mode=mode, source=source, size=size:
+                             buildScenario(engine, mode, source, size, backend))
+                    scenarios.append((name, setup, renderPattern))
+        name = 'colour/RGBConverter/spectral/{}'.format(size)
+        setup = lambda size=size: renderPattern(buildScenario('simulation', 'local', 'spectral', size, backend))
+        scenarios.append((name, setup, RGBConverter))
+        name = 'colour/renderImage/spectral/{}'.format(size)
+        setup = lambda size=size: buildScenario('simulation', 'local', 'spectral', size, backend)
+        scenarios.append((name, setup, lambda sim: renderImage(sim, is_colored=True)))
+    return scenarios
+
+'''
+    Run a scenario, the output is a dict of its best wall time (s) and peak traced memory (bytes)
+'''
+def runScenario(setup, run, repeat):
+    times = []
+    for _ in range(repeat):
+        data = setup()
+        start = time.perf_counter()
+        run(data)
+        times.append(time.perf_counter() - start)
+
+    data = setup()
+    tracemalloc.start()
+    try:
+        run(data)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {'time': min(times), 'peak_memory': peak}
+
+'''
+    Compare results with a baseline, the output is a list of
+    (name, metric, baseline value, new value, ratio) over the threshold
+'''
+def compareResults(results, baseline, threshold):
+    regressions = []
+    for name, entry in results.items():
+        if name not in baseline:
+            continue
+        for metric in ('time', 'peak_memory'):
+            old, new = baseline[name][metric], entry[metric]
+            if old > 0 and new / old > threshold:
+                regressions.append((name, metric, old, new, new / old))
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the RealMichelson simulation and colour path.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[50, 100, 200], help='screen grid sizes')
+    parser.add_argument('--repeat', type=int, default=3, help='timed repeats per scenario, the best one is kept')
+    parser.add_argument('--filter', default='', help='only run scenarios whose name contains this text')
+    parser.add_argument('--backend', default='auto', choices=('auto',) + tuple(availableBackends()),
+                        help='compute backend of simulation, auto (the fastest one) or one of the installed ones')
+    parser.add_argument('--output', help='save results as JSON to this file')
+    parser.add_argument('--baseline', help='compare with results saved by an earlier run')
+    parser.add_argument('--threshold', type=float, default=1.25,
+                        help='ratio to the baseline above which a metric counts as a regression')
+    args = parser.parse_args(argv)
+
+    results = {}
+    for name, setup, run in getScenarios(args.sizes, args.backend):
+        if args.filter not in name:
+            continue
+        results[name] = runScenario(setup, run, args.repeat)
+        print('{:<48} {:>10.4f} s {:>10.1f} MB'.format(name, results[name]['time'], results[name]['peak_memory'] / 2 ** 20))
+
+    if args.output:
+        report = {'machine': {'python': platform.python_version(), 'numpy': np.__version__,
+                              'platform': platform.platform(), 'backend': getBackend(args.backend).name},
+                  'results': results}
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+        regressions = compareResults(results, baseline, args.threshold)
+        for name, metric, old, new, ratio in regressions:
+            print('REGRESSION {} {}: {:.4g} -> {:.4g} ({:.2f}x)'.format(name, metric, old, new, ratio))
+        if regressions:
+            return 1
+        print('no regressions against {}'.format(args.baseline))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,251 @@
+import os
+import copy
+import hashlib
+import threading
+from collections import OrderedDict
+import numpy as np
+
+from pattern import PatternResult, reduceSpectralLines
+
+'''
+    Cache of rendered interference patterns, for simulation.MichelsonSimulation and
+    simulation_corr.MichelsonSimulation.
+
+    A result is keyed on a stable hash of everything the physics depends on (the engine,
+    mirrors, sources, screen, interference mode, precision and anti-aliasing, see getSceneKey) together with
+    its output kind ('spectrum', 'xyz' or 'total', see MichelsonSimulation.screenIntensity).
+    Results are kept in an in-memory LRU tier, and optionally in an on-disk tier of .npz files
+    which survives the process, e.g. notebook reruns; both tiers have size limits and evict
+    the least recently used results first.
+
+    'xyz' and 'total' are derived from a cached 'spectrum' of the same scene when there is one,
+    so re-colouring a pattern is a lookup. For this, a scene with no more distinct wavelengths
+    than the 3 xyz channels (e.g. a monochromatic source) is always computed and kept as its spectrum.
+'''
+
+'''
+    Get the stable hash (a hex string) of the scene of simulation, the same in every process
+'''
+def getSceneKey(simulation):
+    digest = hashlib.sha256()
+    def update(value):
+        if isinstance(value, np.ndarray) and value.dtype != object:
+            value = np.ascontiguousarray(value, dtype=float)
+            digest.update(repr(value.shape).encode())
+            digest.update(value.tobytes())
+        elif isinstance(value, (list, tuple)):
+            digest.update(b'[')
+            for item in value:
+                update(item)
+            digest.update(b']')
+        elif isinstance(value, (bool, int, float, str, type(None), np.number, np.bool_)):
+            digest.update(repr(value).encode())
+        else:
+            # sources and other plain objects: their class and attributes
+            digest.update(type(value).__name__.encode())
+            for name, item in sorted(vars(value).items()):
+                digest.update(name.encode())
+                update(item)
+        digest.update(b';')
+
+    screen = simulation.screen
+    update(type(simulation).__module__)
+    update([np.asarray(mirror, dtype=float) for mirror in (simulation.mirror_G, simulation.mirror_M1, simulation.mirror_M2)])
+    update(list(simulation.source_list))
+    update([screen.shape, screen.size, screen.distance, screen.normal, screen.row_axis] if screen is not None else None)
+    update(bool(simulation.islocalInterference))
+    update(np.dtype(getattr(simulation, 'precision', np.float64)).name)
+    update(getattr(simulation, 'antialiasing', None))
+    return digest.hexdigest()
+
+class RenderCache:
+    """An LRU cache of rendered patterns, in memory and optionally on disk.
+
+    The memory tier keeps at most max_items results taking at most
+    max_bytes, and the disk tier (when a directory is given) keeps .npz
+    files taking at most max_disk_bytes. A result found on disk is moved
+    into memory again. Cached arrays are read-only. The cache may be shared
+    between threads, e.g. the GUI and its render worker.
+
+    """
+
+    def __init__(self, max_items=64, max_bytes=2 ** 28, directory=None, max_disk_bytes=2 ** 30):
+        self.max_items = int(max_items)
+        self.max_bytes = int(max_bytes)
+        self.directory = directory
+        self.max_disk_bytes = int(max_disk_bytes)
+        self.entries = OrderedDict()     # (key, output) -> (values, wavelengths), least recently used first
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+
+    def get(self, key, output):
+        """Get the cached '(values, wavelengths)' of a scene key and output, or None."""
+        with self.lock:
+            if (key, output) in self.entries:
+                self.entries.move_to_end((key, output))
+                return self.entries[(key, output)]
+        path = self.getPath(key, output)
+        if path is None or not os.path.exists(path):
+            return None
+        try:
+            with np.load(path) as data:
+                values, wavelengths = data['values'], data['wavelengths']
+            os.utime(path)                # the modification time orders the disk tier
+        except (OSError, ValueError, KeyError):
+            return None                   # evicted meanwhile, or a broken file
+        return self.putMemory(key, output, values, wavelengths)
+
+    def put(self, key, output, values, wavelengths):
+        """Cache the '(values, wavelengths)' of a scene key and output, in both tiers."""
+        values, wavelengths = self.putMemory(key, output, values, wavelengths)
+        path = self.getPath(key, output)
+        if path is not None:
+            # unique per process and thread, as a cache directory can be shared by several processes
+            temporary = path[:-len('.npz')] + '.{}.{}.tmp.npz'.format(os.getpid(), threading.get_ident())
+            np.savez(temporary, values=values, wavelengths=wavelengths)
+            os.replace(temporary, path)
+            self.evictDisk()
+        return values, wavelengths
+
+    def putMemory(self, key, output, values, wavelengths):
+        values, wavelengths = np.array(values, dtype=float), np.array(wavelengths, dtype=float)
+        values.flags.writeable = False
+        wavelengths.flags.writeable = False
+        size = values.nbytes + wavelengths.nbytes
+        if size > self.max_bytes:
+            return values, wavelengths    # too large for the memory tier
+        with self.lock:
+            if (key, output) in self.entries:
+                old = self.entries.pop((key, output))
+                self.nbytes -= old[0].nbytes + old[1].nbytes
+            self.entries[(key, output)] = values, wavelengths
+            self.nbytes += size
+            while len(self.entries) > self.max_items or self.nbytes > self.max_bytes:
+                old = self.entries.popitem(last=False)[1]
+                self.nbytes -= old[0].nbytes + old[1].nbytes
+        return values, wavelengths
+
+    def getPath(self, key, output):
+        if self.directory is None:
+            return None
+        return os.path.join(self.directory, '{}-{}.npz'.format(key, output))
+
+    def evictDisk(self):
+        files = []
+        for name in os.listdir(self.directory):
+            if name.endswith('.npz') and '.tmp.' not in name:
+                path = os.path.join(self.directory, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.max_disk_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+
+    def clear(self, disk=False):
+        """Empty the memory tier, and the disk tier as well with disk=True."""
+        with self.lock:
+            self.entries.clear()
+            self.nbytes = 0
+        if disk and self.directory is not None:
+            for name in os.listdir(self.directory):
+                if name.endswith('.npz'):
+                    os.remove(os.path.join(self.directory, name))
+
+    def __len__(self):
+        return len(self.entries)
+
+    def getComputeOutput(self, wavelengths, output):
+        """The output to compute and keep for a requested one, see the module notes."""
+        if output != 'spectrum' and np.size(wavelengths) <= 3:
+            return 'spectrum'
+        return output
+
+    def lookup(self, simulation, output='spectrum', key=None):
+        """Get the cached '(values, wavelengths)' of the full screen of simulation, or None.
+
+        values is np.array of shape (P, C), as given by screenIntensity; an
+        'xyz' or 'total' output is derived from a cached 'spectrum'.
+
+        """
+
+        if key is None:
+            key = getSceneKey(simulation)
+        result = self.get(key, output)
+        if result is None and output != 'spectrum':
+            spectrum = self.get(key, 'spectrum')
+            if spectrum is not None:
+                result = reduceSpectralLines(spectrum[0], spectrum[1], output), spectrum[1]
+        with self.lock:
+            if result is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return result
+
+    def screenIntensity(self, simulation, output='spectrum'):
+        """The same as simulation.screenIntensity() for the full screen, looked up in the cache first."""
+        key = getSceneKey(simulation)
+        result = self.lookup(simulation, output, key)
+        if result is not None:
+            return result
+        _, wavelengths = simulation.screenIntensity(slice(0, 0))
+        compute_output = self.getComputeOutput(wavelengths, output)
+        values, wavelengths = self.put(key, compute_output, *simulation.screenIntensity(output=compute_output))
+        if compute_output != output:
+            return reduceSpectralLines(values, wavelengths, output), wavelengths
+        return values, wavelengths
+
+    def interference(self, simulation):
+        """The same as nonlocalInterference/localInterference of simulation in its current mode, cached."""
+        screen = simulation.screen
+        intensity, wavelengths = self.screenIntensity(simulation, 'spectrum')
+        return PatternResult(intensity.reshape(screen.shape + (-1,)), screen.points.reshape(screen.shape + (3,)), wavelengths)
+
+    def sweepMirrorM1(self, simulation, locs, keep_spectrum=False):
+        """The same as simulation.sweepMirrorM1, where every frame is cached as a scene of its own."""
+        locs = np.array(locs, dtype=float).reshape(-1, 3)
+        return self.sweep(simulation, locs, 'mirror_M1', lambda frame, value: [value, frame.mirror_M1[1]],
+                          simulation.sweepMirrorM1, keep_spectrum)
+
+    def sweepMirrorM2(self, simulation, directions, keep_spectrum=False):
+        """The same as simulation.sweepMirrorM2, where every frame is cached as a scene of its own."""
+        directions = np.array(directions, dtype=float).reshape(-1, 3)
+        return self.sweep(simulation, directions, 'mirror_M2', lambda frame, value: [frame.mirror_M2[0], value],
+                          simulation.sweepMirrorM2, keep_spectrum)
+
+    # look every frame up, with mirror replaced by makeMirror(frame, value), and sweep the missing ones together
+    def sweep(self, simulation, values, mirror, makeMirror, sweepFunction, keep_spectrum):
+        height, width = simulation.screen.shape
+        keys = []
+        for value in values:
+            frame = copy.copy(simulation)       # shallow, the image cache of simulation is not touched
+            setattr(frame, mirror, makeMirror(frame, value))
+            if getattr(frame, 'antialiasing', None) is not None:
+                frame.antialiasing = None       # sweeps are never anti-aliased, key the frames as they are rendered
+            keys.append(getSceneKey(frame))
+
+        frames = [self.lookup(simulation, 'spectrum', key) for key in keys]
+        missing = [i for i, frame in enumerate(frames) if frame is None]
+        if missing:
+            _, wavelengths = simulation.screenIntensity(slice(0, 0))
+            stack = sweepFunction(values[missing], keep_spectrum=True)
+            for i, spectrum in zip(missing, stack):
+                frames[i] = self.put(keys[i], 'spectrum', spectrum.reshape(height * width, -1), wavelengths)
+
+        stack = np.array([frame[0] for frame in frames]).reshape(len(frames), height, width, -1)
+        if keep_spectrum:
+            return stack
+        return stack.sum(axis=3)
@@ -1,10 +1,83 @@
 # modified from colour_system.py by christian, from https://scipython.com/blog/converting-a-spectrum-to-a-colour/
+import os
 import numpy as np
 
+# the CIE colour matching function table, next to this file, and its binary form written on first load
+cmf_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cie-cmf.txt')
+cmf_cache_path = os.path.splitext(cmf_path)[0] + '.npy'
+
+def load_cmf():
+    """Load the colour matching function table, shape (81, 3).
+
+    The text table is parsed once and saved as a .npy file beside it, which
+    is read instead as long as it is newer than the text table. If the
+    .npy file cannot be written (e.g. a read-only install), the text table
+    is simply parsed every time.
+
+    """
+
+    try:
+        if os.path.getmtime(cmf_cache_path) >= os.path.getmtime(cmf_path):
+            return np.load(cmf_cache_path)
+    except (OSError, ValueError):
+        pass
+    cmf = np.loadtxt(cmf_path, usecols=(1,2,3))
+    try:
+        temporary = '{}.{}.tmp.npy'.format(os.path.splitext(cmf_cache_path)[0], os.getpid())
+        np.save(temporary, cmf)
+        os.replace(temporary, cmf_cache_path)
+    except OSError:
+        pass
+    return cmf
+
+class LazyTable:
+    """A class attribute computed by a function on first access, then kept.
+
+    With key, a function of the class, one value is kept per key instead,
+    so that the attribute is computed again whenever the key changes.
+
+    """
+
+    def __init__(self, function, key=None):
+        self.function = function
+        self.name = function.__name__
+        self.key = key
+        self.values = {}
+
+    @classmethod
+    def keyed_by(cls, key):
+        """A decorator making a LazyTable kept per key(class)."""
+        return lambda function: cls(function, key)
+
+    def __get__(self, obj, owner):
+        key = None if self.key is None else self.key(owner)
+        if key in self.values:
+            return self.values[key]
+        value = self.function(owner)
+        value.flags.writeable = False
+        if self.key is None:
+            setattr(owner, self.name, value)     # replaces the descriptor, later lookups are plain
+        else:
+            self.values[key] = value
+        return value
+
 def xyz_from_xy(x, y):
     """Return the vector (x, y, 1-x-y)."""
     return np.array((x, y, 1-x-y))
 
+def interpolate_table(table, n):
+    """Linearly interpolate the rows of table onto a grid n times finer.
+
+    The rows of the input are kept exactly, at every n-th row of the
+    output, which has (len(table) - 1) * n + 1 rows.
+
+    """
+
+    position = np.arange((len(table) - 1) * n + 1) / n
+    low = np.minimum(position.astype(int), len(table) - 2)
+    fraction = (position - low)[:, np.newaxis]
+    return table[low] * (1 - fraction) + table[low + 1] * fraction
+
 class ColourSystem:
     """A class representing a colour system.
 
@@ -15,8 +88,19 @@ class ColourSystem:
 
     """
 
-    # The CIE colour matching function for 380 - 780 nm in 5 nm intervals
-    cmf = np.loadtxt('cie-cmf.txt', usecols=(1,2,3))
+    # The CIE colour matching function for 380 - 780 nm in 5 nm intervals, loaded on first use
+    @LazyTable
+    def cmf(cls):
+        return load_cmf()
+
+    # The same, linearly interpolated onto a 0.1 nm grid for lookups at any wavelength;
+    # cmf_step must divide the cmf_interval of the table, and the table is rebuilt when it changes
+    cmf_interval = 5
+    cmf_step = 0.1
+
+    @LazyTable.keyed_by(lambda cls: (cls.cmf_interval, cls.cmf_step))
+    def cmf_table(cls):
+        return interpolate_table(cls.cmf, round(cls.cmf_interval / cls.cmf_step))
 
     def __init__(self, red, green, blue, white):
         """Initialise the ColourSystem object.
@@ -38,6 +122,26 @@ class ColourSystem:
         # xyz -> rgb transformation matrix
         self.T = self.MI / self.wscale[:, np.newaxis]
 
+    @classmethod
+    def cmf_at(cls, wavelengths):
+        """Return the colour-matching function at the given wavelengths.
+
+        wavelengths (in nm) has shape (N,), the result has shape (N, 3).
+        The values are looked up in cmf_table, i.e. cmf linearly
+        interpolated on a 0.1 nm grid, so a wavelength off the 5 nm grid
+        (e.g. a 632.8 nm HeNe line) is not truncated to its bin. On the
+        5 nm grid the values are exactly those of cmf; wavelengths outside
+        380-780 nm give zero.
+
+        """
+
+        wavelengths = np.asarray(wavelengths, dtype=float).reshape(-1)
+        idx = np.rint((wavelengths - 380) / cls.cmf_step)
+        inside = (idx >= 0) & (idx < len(cls.cmf_table))
+        weights = np.zeros((np.size(wavelengths), 3))
+        weights[inside] = cls.cmf_table[idx[inside].astype(int)]
+        return weights
+
     def xyz_to_rgb(self, xyz, out_fmt=None):
         """Transform from xyz to rgb representation of colour.
 
@@ -84,12 +188,42 @@ class ColourSystem:
         #return XYZ / den
         return XYZ # cancel normalization (by YY)
 
+    @classmethod
+    def lines_to_xyz(cls, wavelengths, intensities):
+        """Convert spectral lines at any wavelengths to xyz.
+
+        wavelengths (in nm) has shape (N,) and intensities has shape
+        (..., N), e.g. one line spectrum per pixel; the result has shape
+        (..., 3). See cmf_at.
+
+        """
+
+        return np.einsum('...n,nc->...c', intensities, cls.cmf_at(wavelengths))
+
     def spec_to_rgb(self, spec, out_fmt=None):
         """Convert a spectrum to an rgb value."""
 
         xyz = self.spec_to_xyz(spec)
         return self.xyz_to_rgb(xyz, out_fmt)
 
+    def xyz_to_rgb_array(self, xyz):
+        """Transform an array of xyz points, shape (..., 3), to rgb.
+
+        This is the array form of xyz_to_rgb: every point out of the rgb
+        gamut is desaturated, and every point with a component above 1 is
+        normalized on its maximum value, all at once. Fractional rgb
+        components are returned with shape (..., 3).
+
+        """
+
+        rgb = np.einsum('ij,...j->...i', self.T, xyz)
+        # We're not in the RGB gamut: approximate by desaturating
+        w = - np.min(rgb, axis=-1, keepdims=True)
+        rgb = np.where(w > 0, rgb + w, rgb)
+        # Normalize the rgb vector only when max value > 1
+        rgb_max = np.max(rgb, axis=-1, keepdims=True)
+        return np.where(rgb_max > 1, rgb / np.where(rgb_max > 1, rgb_max, 1), rgb)
+
 illuminant_D65 = xyz_from_xy(0.3127, 0.3291)
 cs_hdtv = ColourSystem(red=xyz_from_xy(0.67, 0.33),
                        green=xyz_from_xy(0.21, 0.71),
@@ -0,0 +1,133 @@
+import os
+import multiprocessing
+import numpy as np
+
+from pattern import reduceSpectralLines, getChannelCount, pattern_outputs
+from parallel_render import getTiles
+from visual import channelsToImage
+
+'''
+    Rendering to memory-mapped .npy files, for screens too large to hold in memory.
+
+    A 4096*4096 screen with the 81 wavelengths of a spectral source is about 10 GB in float64.
+    renderToFile writes the (H, W, C) result of screenIntensity (see MichelsonSimulation.screenIntensity
+    for the outputs 'spectrum', 'xyz' and 'total') straight into a .npy file opened with
+    np.lib.format.open_memmap, tile_size screen points at a time, optionally with a pool of worker
+    processes that all write into the same file. The wavelengths and output kind are saved next to it,
+    in path with '.npy' replaced by '.meta.npz', once every tile is written.
+
+    cubeToImage then converts such a file to the image of renderImage, again tile by tile, optionally
+    into another .npy file. The memory used by either is bounded by the tile size, not the screen size.
+
+    Example:
+        renderToFile(simulation, 'cube.npy', workers=8)
+        image = cubeToImage('cube.npy', is_colored=True, image_path='rgb.npy')
+'''
+
+'''
+    Get the path of the metadata file of the cube at path
+'''
+def getMetadataPath(path):
+    root, _ = os.path.splitext(path)
+    return root + '.meta.npz'
+
+'''
+    Open the cube rendered at path, the output is (cube, wavelengths, output),
+    where cube is a read-only np.memmap of shape (H, W, C)
+'''
+def openCube(path):
+    with np.load(getMetadataPath(path)) as metadata:
+        wavelengths, output = metadata['wavelengths'], str(metadata['output'])
+    return np.load(path, mmap_mode='r'), wavelengths, output
+
+# state of a worker process, set once by _initWorker
+_worker = {}
+
+def _initWorker(simulation, path, output):
+    _worker['simulation'] = simulation
+    _worker['output_kind'] = output
+    _worker['cube'] = np.load(path, mmap_mode='r+')
+
+def _renderTile(tile):
+    start, stop = tile
+    cube = _worker['cube']
+    values, _ = _worker['simulation'].screenIntensity(slice(start, stop), _worker['output_kind'])
+    cube.reshape(-1, cube.shape[-1])[start:stop] = values
+    return stop - start
+
+'''
+    This function renders the interference pattern of simulation in the current mode into the
+    .npy file path, with the channels of output ('spectrum', 'xyz' or 'total'), of dtype dtype
+    (np.float32 halves the file). The screen is rendered tile_size points at a time, by a pool of
+    worker processes when workers > 1 (on 'spawn' platforms, call it under 'if __name__ == "__main__":').
+    log, if given, is called with a progress message after every tile.
+    The output is the same as openCube(path).
+'''
+def renderToFile(simulation, path, output='spectrum', tile_size=65536, dtype=np.float64, workers=1, log=None):
+    if output not in pattern_outputs:
+        raise ValueError('output must be one of {}'.format(pattern_outputs))
+    screen = simulation.screen
+    n_points = len(screen)
+    _, wavelengths = simulation.screenIntensity(slice(0, 0))
+    shape = screen.shape + (getChannelCount(wavelengths, output),)
+
+    metadata_path = getMetadataPath(path)
+    if os.path.exists(metadata_path):
+        os.remove(metadata_path)            # the file is incomplete until the metadata is written again
+    cube = np.lib.format.open_memmap(path, mode='w+', dtype=dtype, shape=shape)
+    del cube                                # only the header is written here, the tiles are filled below
+
+    tiles = getTiles(n_points, tile_size)
+    done = 0
+    if workers > 1 and len(tiles) > 1:
+        with multiprocessing.Pool(min(workers, len(tiles)), initializer=_initWorker,
+                                  initargs=(simulation, path, output)) as pool:
+            for n in pool.imap_unordered(_renderTile, tiles):
+                done += n
+                if log is not None:
+                    log('{}/{} points'.format(done, n_points))
+    else:
+        _initWorker(simulation, path, output)
+        try:
+            for tile in tiles:
+                done += _renderTile(tile)
+                if log is not None:
+                    log('{}/{} points'.format(done, n_points))
+            _worker['cube'].flush()
+        finally:
+            _worker.clear()
+
+    temporary = metadata_path[:-len('.npz')] + '.tmp.npz'
+    np.savez(temporary, wavelengths=wavelengths, output=output)
+    os.replace(temporary, metadata_path)
+    return openCube(path)
+
+'''
+    This function converts the cube rendered at path (see renderToFile) to the image of renderImage:
+    an (H, W, 3) RGB map if is_colored, else the (H, W) total intensity; the cube must have the
+    'spectrum' output, or the 'xyz' or 'total' output of the image. The cube is read tile_size
+    screen points (whole rows) at a time. With image_path, the image is written into that .npy file
+    and returned as a np.memmap, else it is returned in memory.
+'''
+def cubeToImage(path, is_colored=True, image_path=None, tile_size=65536):
+    cube, wavelengths, output = openCube(path)
+    height, width = cube.shape[:2]
+    image_output = 'xyz' if is_colored else 'total'
+    if output not in ('spectrum', image_output):
+        raise ValueError('{} image needs a cube of the spectrum or {} output'.format(
+            'a colored' if is_colored else 'an intensity', image_output))
+
+    image_shape = (height, width, 3) if is_colored else (height, width)
+    if image_path is not None:
+        image = np.lib.format.open_memmap(image_path, mode='w+', dtype=float, shape=image_shape)
+    else:
+        image = np.empty(image_shape)
+    tile_rows = max(1, tile_size // max(width, 1))
+    for start in range(0, height, tile_rows):
+        values = np.asarray(cube[start:start + tile_rows], dtype=float)
+        if output != image_output:
+            values = reduceSpectralLines(values, wavelengths, image_output)
+        image[start:start + tile_rows] = channelsToImage(values, is_colored)
+    if image_path is not None:
+        image.flush()
+    return image
@@ -1,4 +1,5 @@
-import sys, os
+import sys, os, copy
+import numpy as np
 
 from PyQt5 import QtCore, QtWidgets
 from PyQt5.QtWidgets import QWidget, QFormLayout, QPushButton, QLineEdit, QInputDialog
@@ -8,11 +9,16 @@ matplotlib.use('Qt5Agg')
 from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas
 from matplotlib.figure import Figure
 
+import profiling
 from simulation import MichelsonSimulation
-from visual import showPattern
+from cache import RenderCache
+from visual import showPattern, renderImage, renderProgressive, showImage
 
 progname = os.path.basename(sys.argv[0])
 
+# the status bar shows the stage timings of every render
+profiling.setEnabled(True)
+
 '''
     Illustrition for interface:
 
@@ -52,11 +58,71 @@ class MyMplCanvas(FigureCanvas):
         pass
 
 
+class RenderWorker(QtCore.QObject):
+    """Renders patterns in a background thread.
+
+    Requests carry a generation number; a request is skipped if a newer one
+    has already been made by the time the worker gets to it, so only the
+    latest parameter set is rendered once the user stops typing.
+    In progressive mode a coarse preview is emitted first, then the full
+    resolution image, and refining stops as soon as the request is stale.
+    Patterns are looked up in (and added to) cache, when one is given.
+    Every image is emitted with the profiling.RenderStats of the request so far,
+    i.e. of all progressive passes up to that image.
+    """
+
+    rendered = QtCore.pyqtSignal(int, object, bool, object)
+
+    def __init__(self, progressive=True, cache=None):
+        QtCore.QObject.__init__(self)
+        self.latest_generation = 0
+        self.progressive = progressive
+        self.cache = cache
+
+    @QtCore.pyqtSlot(int, object, bool)
+    def render(self, generation, simulation, is_colored):
+        if generation != self.latest_generation:
+            return                          # stale request, a newer one is queued
+        if self.progressive:
+            images = renderProgressive(simulation, is_colored, cache=self.cache)
+        else:
+            images = [renderImage(simulation, is_colored, self.cache)]
+        total = profiling.RenderStats()
+        for image in images:
+            if generation != self.latest_generation:
+                return                      # stale request, stop refining
+            stats = None
+            if profiling.enabled:
+                # every pass is recorded on its own, add them up and send a copy to the main thread
+                total.add(profiling.getLastStats())
+                stats = profiling.RenderStats()
+                stats.add(total)
+            self.rendered.emit(generation, image, is_colored, stats)
+
+
 class ScreenCanvas(MyMplCanvas):
-    """Simple canvas with a sine plot."""
+    """Canvas showing the interference pattern on the screen."""
+
+    # delay (in ms) after the last change before rendering, so that typing "100.25" renders once
+    debounce_interval = 300
+    # only blit the image area when a new pattern of the same size arrives, instead of redrawing the figure
+    use_blit = True
+    # show a coarse preview at once, then refine it to full resolution
+    use_progressive = True
+
+    renderRequested = QtCore.pyqtSignal(int, object, bool)
+    # the summary of the stats of each pattern drawn, for the status bar
+    statsChanged = QtCore.pyqtSignal(str)
 
     def __init__(self, *args, **kwargs):
         self.is_colored = True
+        # rendered patterns, so that re-colouring or going back to earlier parameters is a lookup
+        self.render_cache = RenderCache()
+        self.image = None                   # the one AxesImage, updated in place for every pattern
+        self.background = None              # the canvas behind the axes, saved after each full draw
+        self.render_stats = None            # the profiling.RenderStats of the pattern drawn
+        self.drawn_generation = None        # the request drawn last, and the drawing stats of all its passes
+        self.drawing_stats = None
 
         #initialize a simulation
         self.simulation = MichelsonSimulation()
@@ -67,57 +133,115 @@ class ScreenCanvas(MyMplCanvas):
         self.simulation.changeToNonlocal()
 
         MyMplCanvas.__init__(self, *args, **kwargs)
+        self.mpl_connect('draw_event', self.saveBackground)
+
+        # renders run in a worker thread, the latest finished one is drawn on the main thread
+        self.render_generation = 0
+        self.render_thread = QtCore.QThread(self)
+        self.render_worker = RenderWorker(self.use_progressive, self.render_cache)
+        self.render_worker.moveToThread(self.render_thread)
+        self.renderRequested.connect(self.render_worker.render)
+        self.render_worker.rendered.connect(self.showRendered)
+        self.render_thread.start()
+
+        self.render_timer = QtCore.QTimer(self)
+        self.render_timer.setSingleShot(True)
+        self.render_timer.setInterval(self.debounce_interval)
+        self.render_timer.timeout.connect(self.startRender)
 
     def compute_initial_figure(self):
-        showPattern(self.axes, self.simulation, self.is_colored)
+        self.image = showPattern(self.axes, self.simulation, self.is_colored, cache=self.render_cache)
+        self.render_stats = profiling.getLastStats()
+
+    def saveBackground(self, event):
+        self.background = self.copy_from_bbox(self.axes.bbox)
+
+    # restart the debounce timer, the render starts once the input has been quiet for a while
+    def requestRender(self):
+        self.render_timer.start()
+
+    # send a snapshot of the simulation to the worker, any older request still queued will be skipped
+    def startRender(self):
+        self.render_generation += 1
+        self.render_worker.latest_generation = self.render_generation
+        self.renderRequested.emit(self.render_generation, copy.deepcopy(self.simulation), self.is_colored)
+
+    # draw a finished render, unless the parameters have changed since it was requested
+    def showRendered(self, generation, image, is_colored, stats=None):
+        if generation != self.render_generation or self.render_timer.isActive():
+            return
+        with profiling.record() as drawing:
+            same_size = np.shape(self.image.get_array())[:2] == np.shape(image)[:2]
+            self.image = showImage(self.axes, image, is_colored, self.image)
+            with profiling.stage('drawing'):
+                if self.use_blit and same_size and self.background is not None:
+                    # only the pixel buffer has changed: restore the background, redraw the image and blit the axes
+                    self.restore_region(self.background)
+                    self.axes.draw_artist(self.image)
+                    self.blit(self.axes.bbox)
+                else:
+                    self.draw()
+        if generation != self.drawn_generation:
+            self.drawn_generation, self.drawing_stats = generation, profiling.RenderStats()
+        if stats is not None and drawing is not None:
+            self.drawing_stats.addTime('drawing', drawing.wall)
+            self.drawing_stats.wall += drawing.wall
+            stats.add(self.drawing_stats)
+            self.render_stats = stats
+            self.statsChanged.emit(stats.summary())
+
+    def stopRenderThread(self):
+        self.render_timer.stop()
+        self.render_generation += 1
+        self.render_worker.latest_generation = self.render_generation
+        self.render_thread.quit()
+        self.render_thread.wait()
     
     def changeLocality(self, text):
         if text=='local' and self.simulation.islocalInterference==False:
             self.simulation.islocalInterference = True
             self.simulation.changeToLocal()
-            self.axes.cla()
-            showPattern(self.axes, self.simulation, self.is_colored)
-            self.draw()
+            self.requestRender()
         elif text=='nonlocal' and self.simulation.islocalInterference==True:
             self.simulation.islocalInterference = False
             self.simulation.changeToNonlocal()
-            self.axes.cla()
-            showPattern(self.axes, self.simulation, self.is_colored)
-            self.draw()   
+            self.requestRender()
 
+    # only the colour mapping changes, the pattern itself is looked up in the render cache,
+    # so there is nothing to debounce
     def changeColor(self, text):
         if text=='colored' and self.is_colored==False:
             self.is_colored = True 
-            self.axes.cla()
-            showPattern(self.axes, self.simulation, self.is_colored)
-            self.draw()
+            self.startRender()
         elif text=='mono' and self.is_colored==True:
             self.is_colored = False
-            self.axes.cla()
-            showPattern(self.axes, self.simulation, self.is_colored)
-            self.draw()
+            self.startRender()
 
+    # partial input while typing (e.g. "1e-") is ignored until it becomes a number
     def changeSource(self, text):
-        wavelenth = int(text)
-        self.axes.cla()
+        try:
+            wavelenth = int(text)
+        except ValueError:
+            return
         self.simulation.clearSource()
         self.simulation.insertSource([-20, 0, 0], wavelenth)
-        showPattern(self.axes, self.simulation, self.is_colored)
-        self.draw()
+        self.requestRender()
 
     def changeM1(self, text):
-        y = float(text)
+        try:
+            y = float(text)
+        except ValueError:
+            return
         self.simulation.setMirrorM1([0,y,0])
-        self.axes.cla()
-        showPattern(self.axes, self.simulation, self.is_colored)
-        self.draw()
+        self.requestRender()
 
     def changeM2(self, text):
-        ny = float(text) # small angle approx.
+        try:
+            ny = float(text) # small angle approx.
+        except ValueError:
+            return
         self.simulation.setMirrorM2([-1,ny,0])
-        self.axes.cla()
-        showPattern(self.axes, self.simulation, self.is_colored)
-        self.draw()
+        self.requestRender()
 
 
 
@@ -210,6 +334,7 @@ class ApplicationWindow(QtWidgets.QMainWindow):
         l = QtWidgets.QVBoxLayout(self.main_widget)
         sc = ScreenCanvas(self.main_widget, width=5, height=4, dpi=100)
         l.addWidget(sc)
+        self.screen_canvas = sc
 
         idd = InputdialogDemo()
         l.addWidget(idd)
@@ -223,12 +348,16 @@ class ApplicationWindow(QtWidgets.QMainWindow):
         self.main_widget.setFocus()
         self.setCentralWidget(self.main_widget)
 
-        self.statusBar().showMessage("All hail matplotlib!", 2000)
+        # timings of the latest render, see profiling.RenderStats.summary
+        sc.statsChanged.connect(self.statusBar().showMessage)
+        if sc.render_stats is not None:
+            self.statusBar().showMessage(sc.render_stats.summary())
 
     def fileQuit(self):
         self.close()
 
     def closeEvent(self, ce):
+        self.screen_canvas.stopRenderThread()
         self.fileQuit()
 
     def about(self):
@@ -0,0 +1,76 @@
+import os
+import multiprocessing
+from multiprocessing import shared_memory
+import numpy as np
+
+from pattern import PatternResult, getChannelCount
+
+'''
+    Multi-process tiled rendering of a MichelsonSimulation (of simulation or simulation_corr).
+
+    The screen points are split into tiles of consecutive points, and the tiles are
+    evaluated in a process pool. Every worker writes its tiles straight into one
+    shared-memory output buffer, so no intensity array is pickled back to the parent.
+    Each screen point is computed independently of the others, thus the output is
+    exactly the same as a single-process render.
+
+    On platforms starting workers with 'spawn' (Windows, macOS), call renderParallel
+    under 'if __name__ == "__main__":'.
+'''
+
+# state of a worker process, set once by _initWorker
+_worker = {}
+
+def _initWorker(simulation, shm_name, shape, output):
+    shm = shared_memory.SharedMemory(name=shm_name)
+    _worker['simulation'] = simulation
+    _worker['output_kind'] = output
+    _worker['shm'] = shm
+    _worker['output'] = np.ndarray(shape, dtype=float, buffer=shm.buf)
+
+def _renderTile(tile):
+    start, stop = tile
+    intensity, _ = _worker['simulation'].screenIntensity(slice(start, stop), _worker['output_kind'])
+    _worker['output'][start:stop] = intensity
+    return stop - start
+
+'''
+    Get the (start, stop) point ranges of the tiles of a screen with n_points points
+'''
+def getTiles(n_points, tile_size):
+    return [(start, min(start + tile_size, n_points)) for start in range(0, n_points, tile_size)]
+
+'''
+    This function renders the interference pattern of simulation in the current mode
+    with a pool of worker processes (os.cpu_count() by default), tile_size screen points
+    at a time. The output is a PatternResult, the same as nonlocalInterference/localInterference.
+    With output='xyz' or 'total' (see MichelsonSimulation.screenIntensity) the output is instead
+    np.array of shape (H, W, 3) or (H, W, 1), and only those channels are shared between processes.
+'''
+def renderParallel(simulation, workers=None, tile_size=4096, output='spectrum'):
+    if workers is None:
+        workers = os.cpu_count() or 1
+    screen = simulation.screen
+    n_points = len(screen)
+
+    # image sources are computed (and cached) once here, and sent to the workers with the simulation
+    _, wavelengths = simulation.screenIntensity(slice(0, 0))
+    shape = (n_points, getChannelCount(wavelengths, output))
+
+    shm = shared_memory.SharedMemory(create=True, size=max(int(np.prod(shape)) * 8, 1))
+    try:
+        shared = np.ndarray(shape, dtype=float, buffer=shm.buf)
+        tiles = getTiles(n_points, tile_size)
+        with multiprocessing.Pool(min(workers, max(len(tiles), 1)), initializer=_initWorker,
+                                  initargs=(simulation, shm.name, shape, output)) as pool:
+            for _ in pool.imap_unordered(_renderTile, tiles):
+                pass
+        intensity = shared.copy()
+        del shared
+    finally:
+        shm.close()
+        shm.unlink()
+
+    if output != 'spectrum':
+        return intensity.reshape(screen.shape + (-1,))
+    return PatternResult(intensity.reshape(screen.shape + (-1,)), screen.points.reshape(screen.shape + (3,)), wavelengths)
@@ -0,0 +1,100 @@
+import numpy as np
+
+from colour_system import ColourSystem
+
+# the kinds of output of the interference kernels, see reduceSpectralLines
+pattern_outputs = ('spectrum', 'xyz', 'total')
+
+def groupByWavelength(intensity, wavelength):
+    """Add up intensities of spectral lines sharing the same wavelength.
+
+    intensity has shape (..., N) for N spectral lines with the given
+    wavelengths. Returns the grouped intensity with shape (..., L) and the
+    L distinct wavelengths in ascending order. Each screen point is reduced
+    on its own, so the result does not depend on how the screen points
+    were batched.
+
+    """
+
+    wavelength = np.ravel(np.asarray(wavelength, dtype=float))
+    wavelengths = np.unique(wavelength)
+    if np.size(wavelength) == 0:
+        return np.zeros(intensity.shape[:-1] + (0,)), wavelengths
+    order = np.argsort(wavelength, kind='stable')
+    if np.size(wavelengths) == np.size(wavelength):
+        return intensity[..., order], wavelengths
+    starts = np.searchsorted(wavelength[order], wavelengths)
+    return np.add.reduceat(intensity[..., order], starts, axis=-1), wavelengths
+
+def reduceSpectralLines(intensity, wavelength, output='spectrum'):
+    """Reduce intensities of spectral lines, shape (..., N), to output channels.
+
+    With output='spectrum' the lines are grouped onto the L distinct
+    wavelengths (see groupByWavelength), giving shape (..., L). With
+    output='xyz' each line is weighted by the colour-matching function at
+    its wavelength and only the 3 tristimulus channels are kept, giving
+    (..., 3). With output='total' the lines are summed, giving (..., 1).
+
+    """
+
+    if output == 'spectrum':
+        return groupByWavelength(intensity, wavelength)[0]
+    elif output == 'xyz':
+        return ColourSystem.lines_to_xyz(wavelength, intensity)
+    elif output == 'total':
+        return np.sum(intensity, axis=-1, keepdims=True)
+    raise ValueError('output must be one of {}'.format(pattern_outputs))
+
+def getChannelCount(wavelengths, output='spectrum'):
+    """Number of output channels for the distinct wavelengths, see reduceSpectralLines."""
+    if output not in pattern_outputs:
+        raise ValueError('output must be one of {}'.format(pattern_outputs))
+    return {'spectrum': np.size(wavelengths), 'xyz': 3, 'total': 1}[output]
+
+class PatternResult:
+    """A class holding an interference pattern on the screen.
+
+    The pattern is stored as a dense float array of shape (H, W, L), where
+    (H, W) is the screen grid and L is the number of distinct wavelengths
+    of the light sources. Since no interference happens between different
+    sources, sources sharing the same wavelength are simply added up.
+
+    Iterating over the result gives the old list format, one term like
+    '[position on screen, wavelength, intensity]' per screen point and
+    wavelength.
+
+    """
+
+    def __init__(self, intensity, screen, wavelengths):
+        """Initialise the PatternResult object.
+
+        intensity is an array of shape (H, W, L), screen holds the screen
+        coordinates with shape (H, W, 3) and wavelengths (in nm) has
+        shape (L,).
+
+        """
+
+        self.intensity = np.asarray(intensity, dtype=float)
+        self.screen = np.asarray(screen, dtype=float)
+        self.wavelengths = np.asarray(wavelengths, dtype=float)
+
+    @property
+    def shape(self):
+        """The (H, W) shape of the screen grid."""
+        return self.intensity.shape[:2]
+
+    def total(self):
+        """Return the (H, W) intensity summed over all wavelengths."""
+        return self.intensity.sum(axis=2)
+
+    def __len__(self):
+        return self.intensity.size
+
+    def __iter__(self):
+        height, width, _ = self.intensity.shape
+        wavelengths = self.wavelengths.tolist()
+        for i in range(height):
+            for j in range(width):
+                point = self.screen[i, j]
+                for wavelength, intensity in zip(wavelengths, self.intensity[i, j].tolist()):
+                    yield [point, wavelength, intensity]
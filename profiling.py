@@ -0,0 +1,140 @@
+import time
+import threading
+from contextlib import contextmanager, nullcontext
+
+'''
+    Optional per-stage timing of renders.
+
+    Stages of a render (computing image sources, the interference kernels, reducing spectral
+    lines, colour conversion, drawing, ...) are timed with 'with profiling.stage(name):', and
+    counters such as the number of screenPoint-spectralLine evaluations are added with
+    profiling.count. They are collected into the RenderStats of the render running on the
+    current thread, started by 'with profiling.record() as stats:'; entry points like
+    screenIntensity, renderImage and showPattern start one themselves, so after any of them
+    profiling.getLastStats() gives the stats of that call. Nested records share the outermost one.
+
+    Profiling is off by default (see setEnabled); then stage and record are a shared no-op
+    context and count returns at once, which costs well under a microsecond per call.
+'''
+
+enabled = False
+
+# the stats being recorded and the last finished ones, per thread
+_local = threading.local()
+_null = nullcontext()
+
+'''
+    Turn profiling on or off for all threads
+'''
+def setEnabled(flag=True):
+    global enabled
+    enabled = bool(flag)
+
+class RenderStats:
+    """A class holding the timers and counters of one render.
+
+    times maps each stage to its total time in seconds and calls to the
+    number of times it ran, both in the order the stages first ran; counts
+    maps each counter to its total. wall is the time of the whole record.
+
+    """
+
+    def __init__(self):
+        self.times = {}
+        self.calls = {}
+        self.counts = {}
+        self.wall = 0.0
+
+    def stage(self, name):
+        """A context timing one run of the stage name into these stats."""
+        return _Stage(self, name)
+
+    def addTime(self, name, seconds):
+        self.times[name] = self.times.get(name, 0.0) + seconds
+        self.calls[name] = self.calls.get(name, 0) + 1
+
+    def addCount(self, name, n):
+        self.counts[name] = self.counts.get(name, 0) + int(n)
+
+    def add(self, other):
+        """Add the times, calls, counts and wall time of other to these stats."""
+        for name, seconds in other.times.items():
+            self.times[name] = self.times.get(name, 0.0) + seconds
+            self.calls[name] = self.calls.get(name, 0) + other.calls[name]
+        for name, n in other.counts.items():
+            self.addCount(name, n)
+        self.wall += other.wall
+
+    def summary(self):
+        """A one-line summary, e.g. for the status bar of the GUI."""
+        parts = ['{} {:.1f} ms'.format(name, 1e3 * seconds) for name, seconds in self.times.items()]
+        parts += ['{:,} {}'.format(n, name) for name, n in self.counts.items()]
+        return 'render {:.1f} ms: {}'.format(1e3 * self.wall, ', '.join(parts))
+
+    def __repr__(self):
+        return 'RenderStats({})'.format(self.summary())
+
+class _Stage:
+    __slots__ = ('stats', 'name', 'start')
+
+    def __init__(self, stats, name):
+        self.stats = stats
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stats.addTime(self.name, time.perf_counter() - self.start)
+        return False
+
+'''
+    A context timing the stage name into the stats being recorded on this thread, if any
+'''
+def stage(name):
+    if not enabled:
+        return _null
+    stats = getattr(_local, 'stats', None)
+    if stats is None:
+        return _null
+    return _Stage(stats, name)
+
+'''
+    Add n to the counter name of the stats being recorded on this thread, if any
+'''
+def count(name, n):
+    if not enabled:
+        return
+    stats = getattr(_local, 'stats', None)
+    if stats is not None:
+        stats.addCount(name, n)
+
+'''
+    Record the stages run on this thread inside the context into a RenderStats, which is
+    given by 'as' and by getLastStats() afterwards; inside another record, the outer stats
+    are used. With profiling disabled the context gives None.
+'''
+@contextmanager
+def record():
+    if not enabled:
+        yield None
+        return
+    outer = getattr(_local, 'stats', None)
+    if outer is not None:
+        yield outer
+        return
+    stats = _local.stats = RenderStats()
+    start = time.perf_counter()
+    try:
+        yield stats
+    finally:
+        stats.wall = time.perf_counter() - start
+        _local.stats = None
+        _local.last = stats
+
+'''
+    Get the stats of the last record finished on this thread, or None
+'''
+def getLastStats():
+    return getattr(_local, 'last', None)
@@ -0,0 +1,142 @@
+import numpy as np
+
+class Screen:
+    """A class representing the screen, a rectangular grid of points.
+
+    The screen is centred at distance * normal from the origin (the centre
+    of mirror G). Rows of the grid run along row_axis and columns along
+    normal x row_axis. The grid points are numbered in row-major order; all
+    of them are given as one contiguous array of shape (H*W, 3) by points,
+    built on first use, or only some of them by getPoints, e.g. one tile of
+    a screen too large to hold in memory. The arrays are not pickled.
+
+    For non-local interference the points are real positions on a screen at
+    finite distance. For local interference they are relative to the lens
+    (i.e. our eyes) at the origin, and only their directions matter.
+
+    """
+
+    def __init__(self, shape=(100, 100), size=(5, 5), distance=30, normal=(0, -1, 0), row_axis=(1, 0, 0)):
+        """Initialise the Screen object.
+
+        shape is the (H, W) number of grid points, size is the (height,
+        width) extent of the grid in cm and distance is in cm as well.
+        normal and row_axis give the orientation of the screen; row_axis
+        is made perpendicular to normal.
+
+        """
+
+        self.shape = (int(shape[0]), int(shape[1]))
+        self.size = (float(size[0]), float(size[1]))
+        self.distance = float(distance)
+
+        normal = np.array(normal, dtype=float)
+        normal = normal / np.linalg.norm(normal)
+        row_axis = np.array(row_axis, dtype=float)
+        row_axis = row_axis - np.inner(row_axis, normal) * normal
+        row_axis = row_axis / np.linalg.norm(row_axis)
+        self.normal = normal
+        self.row_axis = row_axis
+        self.column_axis = np.cross(normal, row_axis)
+        self.center = self.distance * normal
+
+        height, width = self.shape
+        # coordinates of the rows and columns of the grid along row_axis and column_axis
+        self.rows = self.size[0] * np.arange(-(height // 2), height - height // 2) / height
+        self.columns = self.size[1] * np.arange(-(width // 2), width - width // 2) / width
+        self._points = None
+        self._directions = None
+
+    @classmethod
+    def nonlocalScreen(cls, shape=(100, 100)):
+        """The default screen for non-local interference: 5cm*5cm, 30cm from G."""
+        return cls(shape, size=(5, 5), distance=30)
+
+    @classmethod
+    def localScreen(cls, shape=(100, 100)):
+        """The default screen for local interference: 2cm*2cm, 2cm from the lens."""
+        return cls(shape, size=(2, 2), distance=2)
+
+    def getIndices(self, index=slice(None)):
+        """The flat indices of the grid points selected by index, a slice or an index array."""
+        if isinstance(index, slice):
+            return np.arange(*index.indices(len(self)))
+        index = np.asarray(index)
+        if index.dtype == bool:
+            return np.flatnonzero(index)
+        return np.where(index < 0, index + len(self), index).astype(np.intp)
+
+    def getPoints(self, index=slice(None)):
+        """The grid points selected by index (see getIndices), shape (P, 3).
+
+        Only these points are computed, unless index selects the whole
+        grid, which builds and caches points; the values are the same as
+        those of points.
+
+        """
+
+        if self._points is not None or self._isWhole(index):
+            return self.points[index]
+        return self._gridPoints(self.getIndices(index))
+
+    def getDirections(self, index=slice(None)):
+        """The unit directions of the grid points selected by index, shape (P, 3), see directions."""
+        if self._directions is not None or self._isWhole(index):
+            return self.directions[index]
+        return self._unit(self.getPoints(index))
+
+    @property
+    def points(self):
+        """All grid points, shape (H*W, 3), built once on first use."""
+        if self._points is None:
+            points = self._gridPoints(np.arange(len(self)))
+            points.flags.writeable = False
+            self._points = points
+        return self._points
+
+    @property
+    def directions(self):
+        """Unit vectors from the origin to every grid point, shape (H*W, 3).
+
+        These are the directions of the parallel light in local
+        interference. They are computed once and cached.
+
+        """
+
+        if self._directions is None:
+            directions = self._unit(self.points)
+            directions.flags.writeable = False
+            self._directions = directions
+        return self._directions
+
+    def _isWhole(self, index):
+        return isinstance(index, slice) and index.indices(len(self)) == (0, len(self), 1)
+
+    def _gridPoints(self, flat):
+        width = self.shape[1]
+        return (self.center + self.rows[flat // width][:, np.newaxis] * self.row_axis
+                + self.columns[flat % width][:, np.newaxis] * self.column_axis)
+
+    @staticmethod
+    def _unit(points):
+        return points / np.linalg.norm(points, axis=1)[:, np.newaxis]
+
+    @property
+    def pitch(self):
+        """The (row, column) spacing of grid points in cm."""
+        return self.size[0] / self.shape[0], self.size[1] / self.shape[1]
+
+    def __getstate__(self):
+        # the grids are rebuilt from the parameters, so that e.g. a worker process only gets its tiles
+        state = dict(self.__dict__)
+        state['_points'] = state['_directions'] = None
+        return state
+
+    def __len__(self):
+        return self.shape[0] * self.shape[1]
+
+    def __iter__(self):
+        return iter(self.points)
+
+    def __repr__(self):
+        return 'Screen(shape={}, size={}, distance={})'.format(self.shape, self.size, self.distance)
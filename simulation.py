@@ -1,6 +1,11 @@
-import math
 import numpy as np
 
+import profiling
+from backend import getBackend, getIntervalArray, getWavenumber
+from pattern import PatternResult, reduceSpectralLines, getChannelCount
+from screen import Screen
+from source import SpectralSource, ExtendedSource
+
 # Our axis is: 
 # [0, 0, 0] = origin = center of mirror_G
 # [1, 0, 0] = x-direction = mirror_G to mirror_M2
@@ -10,7 +15,7 @@ import numpy as np
 spec_wavelengths = np.arange(380, 781, 5)
 
 class MichelsonSimulation:
-    # We have a list of point-source, each with its position and wavelength information.
+    # We have a list of point-source, each is a SpectralSource with its position and spectrum information.
     # We give central mirror(G), position-changing mirror(M1), direction-changing mirror(M2)
     # information respectively, including its central point and direction.
     # All of the above information should be 'np.array' type.
@@ -21,24 +26,37 @@ class MichelsonSimulation:
         self.mirror_M1 = []
         self.mirror_M2 = []
         self.islocalInterference = False
-        self.screen = []
+        self.screen = None
+        # image sources through each arm, cached per source: arm 'S1' (S-mirrorG-mirrorM1) only
+        # depends on G and M1, arm 'S2' (S-mirrorM2-mirrorG) only depends on M2 and G; 'S' holds the
+        # point source positions they were mirrored from, which no mirror changes
+        self.image_cache = {'S': {}, 'S1': {}, 'S2': {}}
+        # screen points are evaluated in chunks, so that the temporaries take about memory_budget bytes,
+        # and the per-wavelength part of the kernels works in this precision (see setPrecision)
+        self.memory_budget = 2 ** 26
+        self.precision = np.float64
+        # the kernels are evaluated by the fastest installed compute backend unless another one is set
+        self.backend = getBackend()
+        # '(threshold, max_factor)' of adaptive supersampling, or None for one sample per pixel (see setAntialiasing)
+        self.antialiasing = None
     
-    # insert a list of source information, including its position and wavelength
+    # insert a monochromatic source, including its position, wavelength and intensity
     def insertSource(self, source_position, wavelength, source_intensity=1):
-        position = np.array(source_position)
-        self.source_list.append([position, wavelength, source_intensity])
-        
-    # include a light source of compound light 
-    def insertSpecSource(self, source_position, spec):
-        position = np.array(source_position)
+        self.source_list.append(SpectralSource(source_position, wavelength, source_intensity))
         
-        for wavelength, source_intensity in zip(spec_wavelengths, spec):
-            self.source_list.append([position, wavelength, source_intensity])
+    # include a light source of compound light, spec gives intensity on the grid of 'spec_wavelengths'
+    # unless other wavelengths are given; the whole spectrum is kept as one source at one position
+    def insertSpecSource(self, source_position, spec, wavelengths=spec_wavelengths):
+        self.source_list.append(SpectralSource(source_position, wavelengths, spec))
 
+    # include an incoherent extended source (an ExtendedSource), made of point source samples
+    def insertExtendedSource(self, source):
+        self.source_list.append(source)
     
     # clear all the point sources
     def clearSource(self):
         self.source_list.clear()
+        self.clearImageCache()
     
     def getSourceList(self):
         return self.source_list
@@ -49,6 +67,7 @@ class MichelsonSimulation:
         direction = np.array(mirror_G_direction)
         self.mirror_G.append(position)
         self.mirror_G.append(direction)
+        self.clearImageCache()
     
     # initialize information of mirror M1 (the type is [np.array, np.array])
     def initialMirrorM1(self, mirror_M1_position, mirror_M1_direction):
@@ -56,6 +75,7 @@ class MichelsonSimulation:
         direction = np.array(mirror_M1_direction)
         self.mirror_M1.append(position)
         self.mirror_M1.append(direction)
+        self.clearImageCache('S1')
     
     # initialize information of mirror M2 (the type is [np.array, np.array])
     def initialMirrorM2(self, mirror_M2_position, mirror_M2_direction):
@@ -63,56 +83,93 @@ class MichelsonSimulation:
         direction = np.array(mirror_M2_direction)
         self.mirror_M2.append(position)
         self.mirror_M2.append(direction)
+        self.clearImageCache('S2')
         
     # set M1 mirror(i.e. set its central point)
     def setMirrorM1(self, loc):
         locVector = np.array(loc)
         self.mirror_M1[0] = locVector
+        self.clearImageCache('S1')
     
     # set M2 mirror(i.e. set its direction)
     def setMirrorM2(self, direction):
         directionVector = np.array(direction)
         self.mirror_M2[1] = directionVector
+        self.clearImageCache('S2')
     
     # move M1 mirror(i.e. move its central point)
     def moveMirrorM1(self, movement):
         movementVector = np.array(movement)
         self.mirror_M1[0] += movementVector
+        self.clearImageCache('S1')
     
     # move M2 mirror(i.e. change its direction)
     def moveMirrorM2(self, directionChange): #TODO: experimentally we measure angle, not direction vector, need a converter
         directionVector = np.array(directionChange)
         self.mirror_M2[1] += directionVector
+        self.clearImageCache('S2')
     
     def getMirror(self):
         G, M1, M2 = self.mirror_G, self.mirror_M1, self.mirror_M2
         return 'G', G, 'M1', M1, 'M2', M2
     
     # change to non-local interference mode, together with finite-distance-screen
-    # we set distance from mirror_G to screen is 30cm
-    def changeToNonlocal(self):
+    # by default the screen is 100*100 points, 5cm*5cm, and the distance from mirror_G to screen is 30cm,
+    # another Screen (e.g. of higher resolution) can be given instead
+    def changeToNonlocal(self, screen=None):
         self.islocalInterference = False
-        screen = []                         # here initialize screen, 100*100 points, 5cm*5cm
-        center = np.array([0, -30, 0])
-        for i in range(-50, 50):
-            for j in range(-50, 50):
-                point = center + np.array([5 * i / 100, 0, 5 * j /100])
-                screen.append(point)
+        if screen is None:
+            screen = Screen.nonlocalScreen()
         self.screen = screen
     
     # change to local interference mode, together with infinite-distance-screen
     # we only consider the relative position between screen and lens(i.e. our eyes)
-    # thus we set lens as [0, 0, 0], the relative distance is 2cm
-    def changeToLocal(self):
+    # thus we set lens as [0, 0, 0], by default the screen is 100*100 points, 2cm*2cm,
+    # and the relative distance is 2cm, another Screen can be given instead
+    def changeToLocal(self, screen=None):
         self.islocalInterference = True
-        screen = []                         # here initialize screen, 100*100 points, 2cm*2cm
-        center = np.array([0, -2, 0])
-        for i in range(-50, 50):
-            for j in range(-50, 50):
-                point = center + np.array([2 * i / 100, 0, 2 * j /100])
-                screen.append(point)
+        if screen is None:
+            screen = Screen.localScreen()
         self.screen = screen
         
+    # set the memory budget (in bytes) for the temporaries of one chunk of screen points
+    def setMemoryBudget(self, memory_budget):
+        self.memory_budget = int(memory_budget)
+    
+    # set the precision of the per-wavelength part of the kernels, 'float64' (default) or 'float32',
+    # float32 halves the memory traffic, while the phase is still formed and reduced in float64
+    def setPrecision(self, precision):
+        precision = np.dtype(precision).type
+        if precision not in (np.float64, np.float32):
+            raise ValueError('precision must be float64 or float32')
+        self.precision = precision
+    
+    # set the compute backend of the kernels by name, 'numpy', 'numexpr', 'numba' or 'auto' (see backend.py),
+    # all of them give the same output up to rounding
+    def setBackend(self, name):
+        self.backend = getBackend(name)
+    
+    # Anti-aliasing for fringes denser than the screen pitch: a pixel where the phase of some spectral line changes
+    # by more than threshold (in rad) across the pixel (see getPhaseStep) is sampled on an n*n grid of subpixels,
+    # n = ceil(phase step / threshold) up to max_factor, and box-filtered (averaged); all other pixels keep their
+    # single sample at the centre, so the cost only grows where the fringes are dense. Where n would exceed
+    # max_factor, the fringes within every subpixel are also box-filtered analytically (see antialiasedIntensity).
+    # threshold=None turns it off.
+    # It applies to screenIntensity and everything built on it, but not to the mirror sweeps.
+    def setAntialiasing(self, threshold=np.pi / 2, max_factor=8):
+        if threshold is None:
+            self.antialiasing = None
+            return
+        if threshold <= 0 or max_factor < 1:
+            raise ValueError('threshold must be positive and max_factor at least 1')
+        self.antialiasing = (float(threshold), int(max_factor))
+    
+    # number of screen points in one chunk, for n_lines spectral lines, n_positions source positions
+    # and n_frames frames evaluated together, so that the temporaries fit in the memory budget
+    def getChunkSize(self, n_lines, n_positions, n_frames=1):
+        bytes_per_point = 8 * n_frames * (3 * n_lines + 8 * n_positions)
+        return max(1, int(self.memory_budget // max(bytes_per_point, 1)))
+    
     def getInterferenceMode(self):
         mode = self.islocalInterference
         if mode:
@@ -126,14 +183,64 @@ class MichelsonSimulation:
     
     # This is the mirror symmetry operation acting on a point source.
     # mirror = [np.array(central position), np.array(direction)]
-    # source = [np.array(position), wavelength], here we just use the former
+    # source_position is a np.array of one position (3,), or of several positions (K, 3)
     def mirrorOperation(self, source_position, mirror):
         const = np.inner(mirror[1], -1 * mirror[0])                 # change a(x-x0)+b(y-y0)+c(z-z0) to ax+by+cz+d
-        coe = -2 * (np.inner(mirror[1], source_position) + const) \
+        coe = -2 * (np.inner(source_position, mirror[1]) + const) \
                 / np.inner(mirror[1], mirror[1])                    # compute the coeffient for image_coordinate calculation
-        image_coordinate = source_position + coe * mirror[1]
+        image_coordinate = source_position + np.multiply.outer(coe, mirror[1])
         return image_coordinate
     
+    # This is the mirror symmetry operation for a batch of mirrors, e.g. the frames of a sweep.
+    # source_position is (M, 3), mirror_position and mirror_direction are (F, 3), the output is (F, M, 3)
+    def mirrorOperationBatch(self, source_position, mirror_position, mirror_direction):
+        const = -np.sum(mirror_direction * mirror_position, axis=1)         # change a(x-x0)+b(y-y0)+c(z-z0) to ax+by+cz+d
+        coe = -2 * (np.inner(mirror_direction, source_position) + const[:, np.newaxis]) \
+                / np.sum(mirror_direction * mirror_direction, axis=1)[:, np.newaxis]
+        image_coordinate = source_position[np.newaxis, :, :] + coe[:, :, np.newaxis] * mirror_direction[:, np.newaxis, :]
+        return image_coordinate
+    
+    # clear the cached image sources of one arm ('S1' or 'S2'), or of both arms and the cached
+    # source positions by default, this is called whenever a mirror of that arm changes
+    def clearImageCache(self, arm=None):
+        for key in (('S', 'S1', 'S2') if arm is None else (arm,)):
+            self.image_cache[key].clear()
+    
+    # get the image sources of a source through both arms, computed once and cached per source and per arm,
+    # positions are the np.array positions to be mirrored, one (3,) position or several (K, 3) positions
+    def getCachedImages(self, source, positions):
+        cache_S1, cache_S2 = self.image_cache['S1'], self.image_cache['S2']
+        if source not in cache_S1:
+            cache_S1[source] = self.getImageS1(positions)
+        if source not in cache_S2:
+            cache_S2[source] = self.getImageS2(positions)
+        return cache_S1[source], cache_S2[source]
+    
+    # get the image sources of positions through both arms, without caching, the output is '(S1, S2)'
+    def getImages(self, positions):
+        return self.getImageS1(positions), self.getImageS2(positions)
+    
+    # image sources through arm S1 only, S-mirrorG-mirrorM1-S1
+    def getImageS1(self, positions):
+        return self.mirrorOperation(self.mirrorOperation(positions, self.mirror_G), self.mirror_M1)
+    
+    # image sources through arm S2 only, S-mirrorM2-mirrorG-S2
+    def getImageS2(self, positions):
+        return self.mirrorOperation(self.mirrorOperation(positions, self.mirror_M2), self.mirror_G)
+    
+    # get the point sources making up a source, the output is '(positions, intensities)':
+    # its own position (3,) and intensities, or for an ExtendedSource the positions (K, 3) of
+    # its first K = n_samples samples, each of them having 1/K of the intensities
+    # The sample positions are cached with the image sources, so that both arms and the sweeps
+    # always see the same samples.
+    def getPointSources(self, source):
+        if isinstance(source, ExtendedSource):
+            cache_S = self.image_cache['S']
+            if source not in cache_S:
+                cache_S[source] = source.samplePositions(0, source.n_samples)
+            return cache_S[source], source.intensities / source.n_samples
+        return source.position, source.intensities
+    
     # This is the projection from a vector to a given axis, both input and output are np.array
     def projection(self, vector, axis):
         coe = np.inner(vector, axis) / np.inner(axis, axis)
@@ -141,19 +248,20 @@ class MichelsonSimulation:
         return projectVector
     
     # Output an image source list, corresponding to source S, 
-    # the term is like '[np.array(position of S1), np.array(position of S2), wavelength]'
+    # the term is like '[np.array(position of S1), np.array(position of S2), wavelengths, intensities]'
     # Detailly speaking, S-mirrorG-mirrorM1-S1, S-mirrorM2-mirrorG-S2
-    def getImageSourceList(self):
-        source_list = self.source_list
+    # For an ExtendedSource the positions are (K, 3), one per sample, all of them emitting the wavelengths.
+    # Some of the sources can be given instead of the whole source list.
+    def getImageSourceList(self, source_list=None):
+        if source_list is None:
+            source_list = self.source_list
         image_list = []
         for source in source_list:
-            position_S, wavelength, source_intensity = source
-            
-            # get position of S1
-            position_S1 = self.mirrorOperation(self.mirrorOperation(position_S, self.mirror_G), self.mirror_M1)
+            position_S, source_intensity = self.getPointSources(source)
+            wavelength = source.wavelengths
             
-            # get position of S2
-            position_S2 = self.mirrorOperation(self.mirrorOperation(position_S, self.mirror_M2), self.mirror_G)
+            # get position of S1 and S2, reusing cached images of unchanged arms
+            position_S1, position_S2 = self.getCachedImages(source, position_S)
             
             image_list.append([position_S1, position_S2, wavelength, source_intensity])  # generate coherent light source unit
         return image_list
@@ -166,57 +274,342 @@ class MichelsonSimulation:
             vec2 = np.array(vec2)
         return np.linalg.norm(vec1 - vec2)
     
+    # Stack the image source list into arrays, so that the interference can be evaluated
+    # for all screenPoint-source combinations at once.
+    # The output is '(position_S1, position_S2, wavelength, source_intensity, position_index)', where
+    # the positions are np.array of shape (M, 3), one row per source position, and the others are
+    # np.array of shape (N,), one entry per spectral line; position_index maps each line to its position.
+    # Another image source list can be given instead of the one of the source list.
+    def getImageSourceArray(self, image_list=None):
+        if image_list is None:
+            image_list = self.getImageSourceList()
+        if len(image_list) == 0:
+            return np.zeros((0, 3)), np.zeros((0, 3)), np.zeros(0), np.zeros(0), np.zeros(0, dtype=int)
+        position_S1 = np.concatenate([np.reshape(coherentSource[0], (-1, 3)) for coherentSource in image_list]).astype(float)
+        position_S2 = np.concatenate([np.reshape(coherentSource[1], (-1, 3)) for coherentSource in image_list]).astype(float)
+        wavelength, source_intensity, position_index = [], [], []
+        start = 0
+        for coherentSource in image_list:
+            n_positions = np.size(coherentSource[0]) // 3     # more than one for the samples of an ExtendedSource
+            wavelength.append(np.tile(coherentSource[2], n_positions))
+            source_intensity.append(np.tile(coherentSource[3], n_positions))
+            position_index.append(np.repeat(np.arange(start, start + n_positions), np.size(coherentSource[2])))
+            start += n_positions
+        return position_S1, position_S2, np.concatenate(wavelength), np.concatenate(source_intensity), np.concatenate(position_index)
+    
+    # get intervals between every screen point and every source, screen is (P, 3) and sources is (..., M, 3),
+    # the output is np.array of shape (..., P, M)
+    def getIntervalArray(self, screen, sources):
+        return getIntervalArray(screen, sources)
+    
+    # Intensity of every screenPoint-spectralLine combination for non-local interference.
+    # screen is (P, 3), position_S1 and position_S2 are (..., M, 3), where optional leading axes are
+    # the frames of a sweep; a position array without them is shared by all frames.
+    # The other inputs are as given by getImageSourceArray, the output is np.array of shape (..., P, N).
+    # visibility, if given, scales the interference term of every combination, shape (P, N).
+    # The work is done by the compute backend, see setBackend.
+    def nonlocalIntensity(self, screen, position_S1, position_S2, wavelength, source_intensity, position_index,
+                          visibility=None):
+        return self.backend.nonlocalIntensity(screen, position_S1, position_S2, wavelength, source_intensity,
+                                              position_index, self.precision, visibility)
+    
+    # Intensity of every screenPoint-spectralLine combination for local interference,
+    # the inputs and output are the same as nonlocalIntensity, except that the screen points are
+    # given by their unit directions (P, 3), e.g. 'Screen.directions'.
+    def localIntensity(self, direction, position_S1, position_S2, wavelength, source_intensity, position_index,
+                       visibility=None):
+        return self.backend.localIntensity(direction, position_S1, position_S2, wavelength, source_intensity,
+                                           position_index, self.precision, visibility)
+    
+    # Intensity on some of the screen points in the current interference mode, points is an index array
+    # or a slice into the screen points (all of them by default), e.g. one tile of the screen.
+    # The output is '(intensity, wavelengths)', where intensity is np.array of shape (P, C)
+    # and 'wavelengths' are the L distinct wavelengths; each point is computed independently of the others.
+    # output selects the C channels (see reduceSpectralLines): 'spectrum' keeps one per wavelength (C = L),
+    # 'xyz' folds the colour-matching functions in and keeps the 3 tristimulus values, 'total' keeps
+    # the summed intensity only. Screen points are evaluated a chunk at a time (see getChunkSize), each chunk
+    # is reduced into the output and its temporaries are freed before the next one, thus with
+    # 'xyz' or 'total' the per-wavelength cube of the whole screen is never built.
+    def screenIntensity(self, points=slice(None), output='spectrum'):
+        with profiling.record():
+            with profiling.stage('image sources'):
+                image_array = self.getImageSourceArray()
+            return self.imageIntensity(points, image_array, output)
+    
+    # Intensity of the image sources given by image_array (as given by getImageSourceArray) on some of
+    # the screen points, the points, output and chunking are the same as for screenIntensity
+    def imageIntensity(self, points, image_array, output='spectrum'):
+        if self.antialiasing is not None:
+            return self.antialiasedIntensity(self.screen.getIndices(points), image_array, output)
+        screen = self.screen.getDirections(points) if self.islocalInterference else self.screen.getPoints(points)
+        return self.pointIntensity(screen, image_array, output)
+    
+    # Intensity of the image sources given by image_array on any points (P, 3), positions for non-local
+    # interference or unit directions for local interference, evaluated a chunk at a time, with the
+    # interference terms scaled by visibility (P, N) if given; the output is the same as screenIntensity
+    def pointIntensity(self, screen, image_array, output='spectrum', visibility=None):
+        intensityFunction = self.localIntensity if self.islocalInterference else self.nonlocalIntensity
+        wavelength = image_array[2]
+        wavelengths = np.unique(wavelength)
+
+        intensity = np.zeros((len(screen), getChannelCount(wavelengths, output)))
+        chunk = self.getChunkSize(np.size(wavelength), len(image_array[0]))
+        for start in range(0, len(screen), chunk):
+            with profiling.stage('interference'):
+                values = intensityFunction(screen[start:start + chunk], *image_array,
+                                           visibility=None if visibility is None else visibility[start:start + chunk])
+            with profiling.stage('reduction'):
+                intensity[start:start + chunk] = reduceSpectralLines(values, wavelength, output)
+        profiling.count('evaluations', len(screen) * np.size(wavelength))
+        return intensity, wavelengths
+    
+    # The change of the path difference of every source position across one pixel at the screen positions
+    # points (P, 3), from its gradient: along the rows (d/d row * row pitch) and along the columns
+    # (d/d column * column pitch). For non-local interference the gradient of |P-S1| - |P-S2| is the difference
+    # of the unit vectors from S1 and S2 to P; for local interference the path difference is d.(S1-S2) with the
+    # direction d = P/|P|. The output is np.array of shape (P, M, 2).
+    def getPathChange(self, points, position_S1, position_S2):
+        screen = self.screen
+        pixel = np.array([screen.pitch[0] * screen.row_axis, screen.pitch[1] * screen.column_axis])
+        if self.islocalInterference:
+            distance = np.linalg.norm(points, axis=1)[:, np.newaxis]
+            direction = points / distance
+            intervalVector = position_S1 - position_S2
+            along = direction @ intervalVector.T
+            gradient = ((intervalVector[np.newaxis] - along[..., np.newaxis] * direction[:, np.newaxis])
+                        / distance[..., np.newaxis])
+        else:
+            unit1 = points[:, np.newaxis] - position_S1
+            unit1 /= np.linalg.norm(unit1, axis=-1, keepdims=True)
+            unit2 = points[:, np.newaxis] - position_S2
+            unit2 /= np.linalg.norm(unit2, axis=-1, keepdims=True)
+            gradient = unit1 - unit2
+        return gradient @ pixel.T
+    
+    # The phase step of every screen point given by the index array indices: the largest change (in rad) of the
+    # phase of any spectral line across the pixel, |row change| + |column change| of the path difference
+    # (see getPathChange) times the wavenumber. The output is np.array of shape (P,).
+    def getPhaseStep(self, indices, image_array=None):
+        if image_array is None:
+            image_array = self.getImageSourceArray()
+        position_S1, position_S2, wavelength, source_intensity, position_index = image_array
+        points = self.screen.getPoints(indices)
+
+        # the largest wavenumber emitted at each source position
+        wavenumber = np.zeros(len(position_S1))
+        lit = np.asarray(source_intensity) != 0
+        np.maximum.at(wavenumber, position_index[lit], getWavenumber(np.asarray(wavelength, dtype=float)[lit]))
+
+        step = np.zeros(len(points))
+        chunk = self.getChunkSize(len(position_S1), len(position_S1))
+        for start in range(0, len(points), chunk):
+            change = np.abs(self.getPathChange(points[start:start + chunk], position_S1, position_S2)).sum(axis=-1)
+            step[start:start + chunk] = np.max(change * wavenumber, axis=1, initial=0)
+        return step
+    
+    # The visibility of the fringes of every spectral line averaged over a subpixel of 1/n of the pitch
+    # centred at each screen position of points (P, 3): for a phase changing linearly by a along the rows and
+    # b along the columns of the subpixel, the mean of cos(phase) is cos(centre phase) * sinc(a/2) * sinc(b/2).
+    # The output is np.array of shape (P, N).
+    def getSubpixelVisibility(self, points, image_array, n):
+        position_S1, position_S2, wavelength, _, position_index = image_array
+        change = self.getPathChange(points, position_S1, position_S2)[:, position_index]
+        phase = change * (getWavenumber(np.asarray(wavelength, dtype=float)) / n)[:, np.newaxis]
+        visibility = np.sinc(phase / (2 * np.pi))          # np.sinc(x) is sin(pi*x)/(pi*x)
+        return visibility[..., 0] * visibility[..., 1]
+    
+    # Intensity on the screen points given by the index array indices with adaptive supersampling,
+    # see setAntialiasing; the output is the same as screenIntensity. Pixels needing more than max_factor
+    # subpixels per side are sampled with max_factor and each subpixel is box-filtered analytically
+    # (see getSubpixelVisibility), so the fringes finer than the subpixels average out instead of aliasing.
+    def antialiasedIntensity(self, indices, image_array, output='spectrum'):
+        threshold, max_factor = self.antialiasing
+        screen = self.screen
+        with profiling.stage('phase step'):
+            factors = np.maximum(np.ceil(self.getPhaseStep(indices, image_array) / threshold), 1)
+        filtered = factors > max_factor
+        factors = np.minimum(factors, max_factor).astype(int)
+        wavelengths = np.unique(image_array[2])
+        intensity = np.zeros((len(indices), getChannelCount(wavelengths, output)))
+
+        for n, box_filter in sorted(set(zip(factors.tolist(), filtered.tolist()))):
+            # an n*n grid of subpixels at the centres of the cells of the pixel, a single sample for n = 1
+            offsets = (np.arange(n) + 0.5) / n - 0.5
+            grid = (offsets[:, np.newaxis, np.newaxis] * screen.pitch[0] * screen.row_axis
+                    + offsets[np.newaxis, :, np.newaxis] * screen.pitch[1] * screen.column_axis).reshape(-1, 3)
+            selected = np.flatnonzero((factors == n) & (filtered == box_filter))
+            block = max(1, self.getChunkSize(np.size(image_array[2]), len(image_array[0])) // (n * n))
+            for start in range(0, len(selected), block):
+                pixels = selected[start:start + block]
+                points = (screen.getPoints(indices[pixels])[:, np.newaxis] + grid).reshape(-1, 3)
+                visibility = None
+                if box_filter:
+                    with profiling.stage('phase step'):
+                        visibility = self.getSubpixelVisibility(points, image_array, n)
+                if self.islocalInterference:
+                    points = points / np.linalg.norm(points, axis=1)[:, np.newaxis]
+                values, _ = self.pointIntensity(points, image_array, output, visibility)
+                intensity[pixels] = values.reshape(len(pixels), n * n, -1).mean(axis=1)
+        profiling.count('supersampled pixels', np.count_nonzero(factors > 1))
+        profiling.count('box-filtered pixels', np.count_nonzero(filtered))
+        return intensity, wavelengths
+    
     # This is the interference pattern calculation for non-local interference.
-    # The output is a list, and the term is like '[position on screen, wavelength, intensity]'
-    # Since no interference between different source, we give an output for
-    # each source-screenPoint combination, we can get final pattern by simply adding their intensity.
+    # The output is a PatternResult, holding the intensity as an array of shape (H, W, L)
+    # for L distinct wavelengths; iterating over it gives terms like '[position on screen, wavelength, intensity]'.
+    # Since no interference between different source, we compute each source-screenPoint combination,
+    # and get final pattern by simply adding intensities of sources with the same wavelength.
+    # All screenPoint-source combinations are evaluated together as array operations.
     def nonlocalInterference(self):
-        enhance_factor = 1e3
-
         if not self.islocalInterference:
-            image_list = self.getImageSourceList()       # get imformation of image-source-pair
-            screen = self.screen                          # get point list of screen
-            pattern = []
-            for point in screen:
-                for coherentSource in image_list:         # calculate for each source-screenPoint combination
-                    point1, point2, wavelength, source_intensity = coherentSource
-
-                    # calculate interval between source and screen straightly, using them to derive phase difference
-                    interval1 = self.getInterval(point1, point)
-                    interval2 = self.getInterval(point2, point)
-                    delta = (10 ** 7) * 2 * math.pi * (interval1 - interval2) \
-                                / wavelength    # derive phase differnce, wavelength is in nm=10^{-7}cm
-
-                    intensity1 = 1/(interval1 ** 2)
-                    intensity2 = 1/(interval2 ** 2)
-                    intensity = intensity1 + intensity2 + \
-                                2 * math.sqrt(intensity1 * intensity2) * math.cos(delta)
-                    pattern.append([point, wavelength, intensity*source_intensity*enhance_factor])              # forming one term, not interfere with others
-            return pattern
+            screen = self.screen                          # get screen, its points are np.array of shape (P, 3)
+            intensity, wavelengths = self.screenIntensity()
+            return PatternResult(intensity.reshape(screen.shape + (-1,)), screen.points.reshape(screen.shape + (3,)), wavelengths)
         else:
             raise Exception('Mode is local interference now, please change mode')
     
     # This is the interference pattern calculation for local interference.
-    # The output is a list, and the term is like '[position on screen, wavelength, intensity]'
+    # The output is a PatternResult, the same as nonlocalInterference.
     def localInterference(self):
         if self.islocalInterference:
-            image_list = self.getImageSourceList()       # get imformation of image-source-pair
-            screen = self.screen                          # get point list of screen
-            pattern = []
-            for point in screen:
-                for coherentSource in image_list:         # calculate for each source-screenPoint combination
-                    point1, point2, wavelength, source_intensity = coherentSource
-                    intervalVector = point1 - point2      # derive vector from one coherent image source to the other
-
-                    # since specified screenPoint gives a pair of parallel light, 
-                    # we follow screenPoint-lightDirection-phaseDifference calculation, 
-                    # type(point) == np.ndarray, and the term denotes relative distance.
-                    direction = np.array(point)
-                    delta = (10 ** 7) * 2 * math.pi * np.inner(intervalVector, direction) / np.linalg.norm(direction) \
-                                / wavelength     # derive phase differnce, wavelength is in nm=10^{-7}cm
-
-                    intensity = 2 + 2 * math.cos(delta)
-                    pattern.append([point, wavelength, intensity*source_intensity])              # forming one term, not interfere with others
-            return pattern
+            screen = self.screen                          # get screen, its points are np.array of shape (P, 3)
+            intensity, wavelengths = self.screenIntensity()
+            return PatternResult(intensity.reshape(screen.shape + (-1,)), screen.points.reshape(screen.shape + (3,)), wavelengths)
+        else:
+            raise Exception('Mode is nonlocal interference now, please change mode')
+    
+    # The interference pattern in the current mode, with every ExtendedSource sampled until the pattern
+    # converges instead of with its fixed n_samples. The samples of each extended source are drawn batch_size
+    # at a time, and the running average of their patterns is updated after each batch; sampling stops once
+    # no pixel changes by more than tolerance relative to its value (pixels darker than 1e-3 of the brightest
+    # one count as that bright), or after max_samples. Point sources are evaluated once as usual.
+    # The output is '(pattern, n_samples)', where pattern is a PatternResult for output='spectrum', else
+    # np.array of shape (H, W, C) (see screenIntensity), and n_samples lists the samples drawn per extended source.
+    def convergedInterference(self, tolerance=1e-3, batch_size=64, max_samples=4096, output='spectrum'):
+        screen = self.screen
+        extended = [source for source in self.source_list if isinstance(source, ExtendedSource)]
+        point_sources = [source for source in self.source_list if not isinstance(source, ExtendedSource)]
+        wavelengths = np.unique(np.concatenate([np.zeros(0)] + [source.wavelengths for source in self.source_list]))
+        total = np.zeros((len(screen), getChannelCount(wavelengths, output)))
+        point_array = self.getImageSourceArray(self.getImageSourceList(point_sources))
+        intensity, point_wavelengths = self.imageIntensity(slice(None), point_array, output)
+        if output == 'spectrum':
+            total[:, np.searchsorted(wavelengths, point_wavelengths)] = intensity
+        else:
+            total += intensity
+
+        n_samples = []
+        for source in extended:
+            accumulated, estimate, n = 0, None, 0
+            while n < max_samples:
+                stop = min(n + batch_size, max_samples)
+                position_S1, position_S2 = self.getImages(source.samplePositions(n, stop))
+                image_array = self.getImageSourceArray([[position_S1, position_S2, source.wavelengths, source.intensities]])
+                intensity, source_wavelengths = self.imageIntensity(slice(None), image_array, output)
+                accumulated = accumulated + intensity
+                n = stop
+                previous, estimate = estimate, accumulated / n
+                if previous is not None:
+                    scale = np.maximum(np.abs(estimate), 1e-3 * np.max(np.abs(estimate)))
+                    if np.all(np.abs(estimate - previous) <= tolerance * scale):
+                        break
+            if output == 'spectrum':
+                total[:, np.searchsorted(wavelengths, source_wavelengths)] += estimate
+            else:
+                total += estimate
+            n_samples.append(n)
+
+        if output != 'spectrum':
+            return total.reshape(screen.shape + (-1,)), n_samples
+        return PatternResult(total.reshape(screen.shape + (-1,)), screen.points.reshape(screen.shape + (3,)), wavelengths), n_samples
+    
+    # Sweep mirror M1 over an array of central points, locs is (F, 3), like calling setMirrorM1 for each frame.
+    # The output is np.array of shape (F, H, W), or (F, H, W, L) with keep_spectrum=True,
+    # where the wavelength axis is the same as the 'wavelengths' of a PatternResult.
+    # The mirror M1 of the simulation itself is left unchanged.
+    def sweepMirrorM1(self, locs, keep_spectrum=False):
+        locs = np.array(locs, dtype=float).reshape(-1, 3)
+        directions = np.broadcast_to(np.array(self.mirror_M1[1], dtype=float), locs.shape)
+        positions = self.getSourcePositionArray()
+
+        # S-mirrorG-mirrorM1-S1 for every frame, while the S2 arm is shared by all frames
+        position_S1 = self.mirrorOperationBatch(self.mirrorOperation(positions, self.mirror_G), locs, directions)
+        _, position_S2, wavelength, source_intensity, position_index = self.getImageSourceArray()
+        return self.sweepInterference(position_S1, position_S2, wavelength, source_intensity, position_index, keep_spectrum)
+    
+    # Sweep mirror M2 over an array of directions, directions is (F, 3), like calling setMirrorM2 for each frame.
+    # The output is the same as sweepMirrorM1, and the mirror M2 of the simulation itself is left unchanged.
+    def sweepMirrorM2(self, directions, keep_spectrum=False):
+        directions = np.array(directions, dtype=float).reshape(-1, 3)
+        locs = np.broadcast_to(np.array(self.mirror_M2[0], dtype=float), directions.shape)
+        positions = self.getSourcePositionArray()
+
+        # S-mirrorM2-mirrorG-S2 for every frame, while the S1 arm is shared by all frames
+        position_S2 = self.mirrorOperation(self.mirrorOperationBatch(positions, locs, directions), self.mirror_G)
+        position_S1, _, wavelength, source_intensity, position_index = self.getImageSourceArray()
+        return self.sweepInterference(position_S1, position_S2, wavelength, source_intensity, position_index, keep_spectrum)
+    
+    # Detector mode: the intensity at a few detector points while mirror M1 moves along its normal, e.g. the
+    # interferogram of Fourier-transform spectroscopy (see spectroscopy.py). points is (D, 3), or one point (3,),
+    # in the coordinates of the screen of the current mode (in local interference only its direction matters),
+    # and displacements is (F,), in cm along the unit normal of M1 from its current position.
+    # All frames are evaluated together as one batched sweep of just these points, instead of the whole screen.
+    # The output is np.array of shape (F, D), or (F, D, L) with keep_spectrum=True; M1 itself is left unchanged.
+    def detectorInterferogram(self, points, displacements, keep_spectrum=False):
+        normal = np.array(self.mirror_M1[1], dtype=float)
+        normal = normal / np.linalg.norm(normal)
+        locs = np.array(self.mirror_M1[0], dtype=float) + np.multiply.outer(np.ravel(displacements), normal)
+        directions = np.broadcast_to(np.array(self.mirror_M1[1], dtype=float), locs.shape)
+        positions = self.getSourcePositionArray()
+
+        position_S1 = self.mirrorOperationBatch(self.mirrorOperation(positions, self.mirror_G), locs, directions)
+        _, position_S2, wavelength, source_intensity, position_index = self.getImageSourceArray()
+        points = np.array(points, dtype=float).reshape(-1, 3)
+        return self.sweepInterference(position_S1, position_S2, wavelength, source_intensity, position_index,
+                                      keep_spectrum, points)
+    
+    # positions of all point sources of the source list, np.array of shape (M, 3) in the order of getImageSourceArray,
+    # the same (cached) positions the image sources were mirrored from
+    def getSourcePositionArray(self):
+        return np.concatenate([np.zeros((0, 3))] + [np.reshape(self.getPointSources(source)[0], (-1, 3))
+                                                    for source in self.source_list]).astype(float)
+    
+    # Evaluate the frames of a sweep as batched array operations, a few frames (and, for a large screen,
+    # a chunk of screen points) at a time to stay in the memory budget; one of position_S1 and
+    # position_S2 is (F, M, 3), the other one is (M, 3) and shared by all frames.
+    # Instead of the screen, some points (D, 3) can be given, then the output has shape (F, D) or (F, D, L).
+    def sweepInterference(self, position_S1, position_S2, wavelength, source_intensity, position_index,
+                          keep_spectrum=False, points=None):
+        if points is not None:
+            screen = points / np.linalg.norm(points, axis=1)[:, np.newaxis] if self.islocalInterference else points
+        elif self.islocalInterference:
+            screen = self.screen.directions
         else:
-            raise Exception('Mode is nonlocal interference now, please change mode')
\ No newline at end of file
+            screen = self.screen.points
+        intensityFunction = self.localIntensity if self.islocalInterference else self.nonlocalIntensity
+        n_frames = max(np.shape(position_S1)[0] if np.ndim(position_S1) == 3 else 0,
+                       np.shape(position_S2)[0] if np.ndim(position_S2) == 3 else 0)
+        # without keep_spectrum every chunk is summed at once, so the per-wavelength stack is never built
+        output = 'spectrum' if keep_spectrum else 'total'
+        stack = np.zeros((n_frames, len(screen), getChannelCount(np.unique(wavelength), output)))
+
+        n_positions = np.shape(position_S1)[-2]
+        frame_chunk = max(1, self.getChunkSize(np.size(wavelength), n_positions) // max(len(screen), 1))
+        point_chunk = self.getChunkSize(np.size(wavelength), n_positions, min(frame_chunk, max(n_frames, 1)))
+        for start in range(0, n_frames, frame_chunk):
+            frames = slice(start, start + frame_chunk)
+            S1 = position_S1[frames] if np.ndim(position_S1) == 3 else position_S1
+            S2 = position_S2[frames] if np.ndim(position_S2) == 3 else position_S2
+            for point_start in range(0, len(screen), point_chunk):
+                chunk = slice(point_start, point_start + point_chunk)
+                with profiling.stage('interference'):
+                    intensity = intensityFunction(screen[chunk], S1, S2, wavelength, source_intensity, position_index)
+                with profiling.stage('reduction'):
+                    stack[frames, chunk] = reduceSpectralLines(intensity, wavelength, output)
+        profiling.count('evaluations', n_frames * len(screen) * np.size(wavelength))
+        if points is None:
+            stack = stack.reshape((n_frames,) + self.screen.shape + (-1,))
+
+        if keep_spectrum:
+            return stack
+        return stack[..., 0]
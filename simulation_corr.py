@@ -1,6 +1,11 @@
 import math
 import numpy as np
 
+import profiling
+from pattern import PatternResult, groupByWavelength, reduceSpectralLines, getChannelCount
+from screen import Screen
+from source import SpectralSource, CorrelatedSource
+
 # Our axis is: 
 # [0, 0, 0] = origin = center of mirror_G
 # [1, 0, 0] = x-direction = mirror_G to mirror_M2
@@ -10,7 +15,7 @@ import numpy as np
 spec_wavelengths = np.arange(380, 781, 5)
 
 class MichelsonSimulation:
-    # We have a list of point-source, each with its position and wavelength information.
+    # We have a list of point-source, each is a SpectralSource with its position and spectrum information.
     # We give central mirror(G), position-changing mirror(M1), direction-changing mirror(M2)
     # information respectively, including its central point and direction.
     # All of the above information should be 'np.array' type.
@@ -21,26 +26,40 @@ class MichelsonSimulation:
         self.mirror_M1 = []
         self.mirror_M2 = []
         self.islocalInterference = False
-        self.screen = []
+        self.screen = None
+        # image sources through each arm, cached per source: arm 'S1' (S-mirrorG-mirrorM1) only
+        # depends on G and M1, arm 'S2' (S-mirrorM2-mirrorG) only depends on M2 and G
+        self.image_cache = {'S1': {}, 'S2': {}}
     
     # insert a list of source information, including its spatialCorrelation, position, wavelength and intensity
-    # if local correlation is necessary, change islocalCorrelate=True
+    # if local correlation is necessary, change islocalCorrelate=True, which gives the source
+    # 4 correlated subsource around (see CorrelatedSource.cross)
     def insertSource(self, source_position, wavelength, islocalCorrelate=False, source_intensity=1):
-        position = np.array(source_position)
-        self.source_list.append([islocalCorrelate, position, wavelength, source_intensity])
+        if islocalCorrelate:
+            source = CorrelatedSource.cross(source_position, wavelength, source_intensity)
+        else:
+            source = SpectralSource(source_position, wavelength, source_intensity)
+        self.source_list.append([islocalCorrelate, source])
         
-    # include a light source of compound light
+    # include a light source of compound light, spec gives intensity on the grid of 'spec_wavelengths'
+    # unless other wavelengths are given; the whole spectrum is kept as one source at one position
     # if local correlation is necessary, change islocalCorrelate=True
-    def insertSpecSource(self, source_position, spec, islocalCorrelate=False):
-        position = np.array(source_position)
-        
-        for wavelength, source_intensity in zip(spec_wavelengths, spec):
-            self.source_list.append([islocalCorrelate, position, wavelength, source_intensity])
+    def insertSpecSource(self, source_position, spec, islocalCorrelate=False, wavelengths=spec_wavelengths):
+        if islocalCorrelate:
+            source = CorrelatedSource.cross(source_position, wavelengths, spec)
+        else:
+            source = SpectralSource(source_position, wavelengths, spec)
+        self.source_list.append([islocalCorrelate, source])
+    
+    # insert a correlated source with any subsource, e.g. 'CorrelatedSource.disk(...)'
+    def insertCorrelatedSource(self, source):
+        self.source_list.append([True, source])
 
     
     # clear all the point sources
     def clearSource(self):
         self.source_list.clear()
+        self.clearImageCache()
     
     def getSourceList(self):
         return self.source_list
@@ -51,6 +70,7 @@ class MichelsonSimulation:
         direction = np.array(mirror_G_direction)
         self.mirror_G.append(position)
         self.mirror_G.append(direction)
+        self.clearImageCache()
     
     # initialize information of mirror M1 (the type is [np.array, np.array])
     def initialMirrorM1(self, mirror_M1_position, mirror_M1_direction):
@@ -58,6 +78,7 @@ class MichelsonSimulation:
         direction = np.array(mirror_M1_direction)
         self.mirror_M1.append(position)
         self.mirror_M1.append(direction)
+        self.clearImageCache('S1')
     
     # initialize information of mirror M2 (the type is [np.array, np.array])
     def initialMirrorM2(self, mirror_M2_position, mirror_M2_direction):
@@ -65,54 +86,53 @@ class MichelsonSimulation:
         direction = np.array(mirror_M2_direction)
         self.mirror_M2.append(position)
         self.mirror_M2.append(direction)
+        self.clearImageCache('S2')
         
     # set M1 mirror(i.e. set its central point)
     def setMirrorM1(self, loc):
         locVector = np.array(loc)
         self.mirror_M1[0] = locVector
+        self.clearImageCache('S1')
     
     # set M2 mirror(i.e. set its direction)
     def setMirrorM2(self, direction):
         directionVector = np.array(direction)
         self.mirror_M2[1] = directionVector
+        self.clearImageCache('S2')
     
     # move M1 mirror(i.e. move its central point)
     def moveMirrorM1(self, movement):
         movementVector = np.array(movement)
         self.mirror_M1[0] += movementVector
+        self.clearImageCache('S1')
     
     # move M2 mirror(i.e. change its direction)
     def moveMirrorM2(self, directionChange): #TODO: experimentally we measure angle, not direction vector, need a converter
         directionVector = np.array(directionChange)
         self.mirror_M2[1] += directionVector
+        self.clearImageCache('S2')
     
     def getMirror(self):
         G, M1, M2 = self.mirror_G, self.mirror_M1, self.mirror_M2
         return 'G', G, 'M1', M1, 'M2', M2
     
     # change to non-local interference mode, together with finite-distance-screen
-    # we set distance from mirror_G to screen is 30cm
-    def changeToNonlocal(self):
+    # by default the screen is 100*100 points, 5cm*5cm, and the distance from mirror_G to screen is 30cm,
+    # another Screen (e.g. of higher resolution) can be given instead
+    def changeToNonlocal(self, screen=None):
         self.islocalInterference = False
-        screen = []                         # here initialize screen, 100*100 points, 5cm*5cm
-        center = np.array([0, -30, 0])
-        for i in range(-50, 50):
-            for j in range(-50, 50):
-                point = center + np.array([5 * i / 100, 0, 5 * j /100])
-                screen.append(point)
+        if screen is None:
+            screen = Screen.nonlocalScreen()
         self.screen = screen
     
     # change to local interference mode, together with infinite-distance-screen
     # we only consider the relative position between screen and lens(i.e. our eyes)
-    # thus we set lens as [0, 0, 0], the relative distance is 2cm
-    def changeToLocal(self):
+    # thus we set lens as [0, 0, 0], by default the screen is 100*100 points, 2cm*2cm,
+    # and the relative distance is 2cm, another Screen can be given instead
+    def changeToLocal(self, screen=None):
         self.islocalInterference = True
-        screen = []                         # here initialize screen, 100*100 points, 2cm*2cm
-        center = np.array([0, -2, 0])
-        for i in range(-50, 50):
-            for j in range(-50, 50):
-                point = center + np.array([2 * i / 100, 0, 2 * j /100])
-                screen.append(point)
+        if screen is None:
+            screen = Screen.localScreen()
         self.screen = screen
         
     def getInterferenceMode(self):
@@ -128,14 +148,30 @@ class MichelsonSimulation:
     
     # This is the mirror symmetry operation acting on a point source.
     # mirror = [np.array(central position), np.array(direction)]
-    # source = [np.array(position), wavelength], here we just use the former
+    # source_position is a np.array of one position (3,), or of several positions (K, 3)
     def mirrorOperation(self, source_position, mirror):
         const = np.inner(mirror[1], -1 * mirror[0])                 # change a(x-x0)+b(y-y0)+c(z-z0) to ax+by+cz+d
-        coe = -2 * (np.inner(mirror[1], source_position) + const) \
+        coe = -2 * (np.inner(source_position, mirror[1]) + const) \
                 / np.inner(mirror[1], mirror[1])                    # compute the coeffient for image_coordinate calculation
-        image_coordinate = source_position + coe * mirror[1]
+        image_coordinate = source_position + np.multiply.outer(coe, mirror[1])
         return image_coordinate
     
+    # clear the cached image sources of one arm ('S1' or 'S2'), or of both arms by default,
+    # this is called whenever a mirror of that arm changes
+    def clearImageCache(self, arm=None):
+        for key in (('S1', 'S2') if arm is None else (arm,)):
+            self.image_cache[key].clear()
+    
+    # get the image sources of a source through both arms, computed once and cached per source and per arm,
+    # positions are the np.array positions to be mirrored, one (3,) position or several (K, 3) positions
+    def getCachedImages(self, source, positions):
+        cache_S1, cache_S2 = self.image_cache['S1'], self.image_cache['S2']
+        if source not in cache_S1:
+            cache_S1[source] = self.mirrorOperation(self.mirrorOperation(positions, self.mirror_G), self.mirror_M1)
+        if source not in cache_S2:
+            cache_S2[source] = self.mirrorOperation(self.mirrorOperation(positions, self.mirror_M2), self.mirror_G)
+        return cache_S1[source], cache_S2[source]
+    
     # This is the projection from a vector to a given axis, both input and output are np.array
     def projection(self, vector, axis):
         coe = np.inner(vector, axis) / np.inner(axis, axis)
@@ -143,52 +179,55 @@ class MichelsonSimulation:
         return projectVector
     
     # Output an image source list, corresponding to source S, 
-    # the term is like '[np.array(position of S1), np.array(position of S2), wavelength]'
+    # the term is like '[islocalCorrelate, np.array(position of S1), np.array(position of S2), wavelengths, intensities]'
     # Detailly speaking, S-mirrorG-mirrorM1-S1, S-mirrorM2-mirrorG-S2
     def getImageSourceList(self):
         source_list = self.source_list
         image_list = []
-        for source in source_list:
-            islocalCorrelate, position_S, wavelength, source_intensity = source
+        for islocalCorrelate, source in source_list:
+            position_S, wavelength, source_intensity = source.position, source.wavelengths, source.intensities
             
             # for non-correlate source (ordinary source)
             if not islocalCorrelate:
-                # get position of S1
-                position_S1 = self.mirrorOperation(self.mirrorOperation(position_S, self.mirror_G), self.mirror_M1)
-
-                # get position of S2
-                position_S2 = self.mirrorOperation(self.mirrorOperation(position_S, self.mirror_M2), self.mirror_G)
+                # get position of S1 and S2, reusing cached images of unchanged arms
+                position_S1, position_S2 = self.getCachedImages(source, position_S)
 
                 # generate coherent light source unit
                 image_list.append([islocalCorrelate, position_S1, position_S2, wavelength, source_intensity])
-            # for correlate source (i.e. with 4 correlated subsource around)
+            # for correlate source (i.e. with correlated subsource around)
             else:
-                # get position of 4 subsource
-                position_left = position_S - np.array([0, 0.5, 0])
-                position_right = position_S + np.array([0, 0.5, 0])
-                position_up = position_S + np.array([0, 0, 0.5])
-                position_down = position_S - np.array([0, 0, 0.5])
-                subsourcePositionList = [position_left, position_right, position_up, position_down]
+                # images of all subsource through both arms, reusing cached images of unchanged arms
+                images_S1, images_S2 = self.getCachedImages(source, source.subsourcePositions)
                 
-                # get image source information
-                imageSource = [islocalCorrelate, wavelength]
-                # central source
-                position_S1 = self.mirrorOperation(self.mirrorOperation(position_S, self.mirror_G), self.mirror_M1)
-                position_S2 = self.mirrorOperation(self.mirrorOperation(position_S, self.mirror_M2), self.mirror_G)
-                imageSource.append([position_S1, source_intensity])
-                imageSource.append([position_S2, source_intensity])
-                # subsource
-                for subsourcePosition in subsourcePositionList:
-                    sub1 = self.mirrorOperation(self.mirrorOperation(subsourcePosition, self.mirror_G), self.mirror_M1)
-                    sub2 = self.mirrorOperation(self.mirrorOperation(subsourcePosition, self.mirror_M2), self.mirror_G)
-                    imageSource.append([sub1, 0.1 * source_intensity])
-                    imageSource.append([sub2, 0.1 * source_intensity])
+                # interleave as S1 and S2 of each subsource, the first one is the reference of phase,
+                # and the intensity of each image source is relative to the source intensity
+                positions = np.stack([images_S1, images_S2], axis=1).reshape(-1, 3)
+                relative_intensity = np.repeat(source.weights, 2)
                 
-                # generate coherent light source unit, first gives islocalCorrelate & wavelength, 
-                # then gives all related image source by '[position, intensity]'.
-                image_list.append(imageSource)
+                # generate coherent light source unit, like '[islocalCorrelate, wavelengths, intensities,
+                # np.array of image source positions (2K, 3), np.array of relative intensities (2K,)]'.
+                image_list.append([islocalCorrelate, wavelength, source_intensity, positions, relative_intensity])
         return image_list
     
+    # Get the spectral lines of each coherent light source unit, the output is '(wavelength, source_intensity, columns)',
+    # where wavelength and source_intensity are np.array over all lines of all units,
+    # and columns[i] is the slice of these lines belonging to the i-th unit.
+    def getSpectralLines(self, image_list):
+        wavelength_list, intensity_list, columns = [], [], []
+        start = 0
+        for coherentSource in image_list:
+            if not coherentSource[0]:
+                wavelength, source_intensity = coherentSource[3], coherentSource[4]
+            else:
+                wavelength, source_intensity = coherentSource[1], coherentSource[2]
+            wavelength_list.append(wavelength)
+            intensity_list.append(source_intensity)
+            columns.append(slice(start, start + np.size(wavelength)))
+            start += np.size(wavelength)
+        if len(image_list) == 0:
+            return np.zeros(0), np.zeros(0), columns
+        return np.concatenate(wavelength_list), np.concatenate(intensity_list), columns
+    
     # get interval between two vector, supporting both type(list) and type(np.ndarray)
     def getInterval(self, vec1, vec2):
         if type(vec1) is not np.ndarray:
@@ -197,120 +236,136 @@ class MichelsonSimulation:
             vec2 = np.array(vec2)
         return np.linalg.norm(vec1 - vec2)
     
-    # This is the interference pattern calculation for non-local interference.
-    # The output is a list, and the term is like '[position on screen, wavelength, intensity]'
-    # Since no interference between different source, we give an output for
-    # each source-screenPoint combination, we can get final pattern by simply adding their intensity.
-    def nonlocalInterference(self):
+    # get intervals between every screen point and every source, screen is (P, 3) and sources is (M, 3),
+    # the output is np.array of shape (P, M)
+    def getIntervalArray(self, screen, sources):
+        difference = screen[:, np.newaxis, :] - sources[np.newaxis, :, :]
+        return np.sqrt(np.sum(difference * difference, axis=-1))
+    
+    # Intensity of an ordinary source on every screen point, for each of its spectral lines.
+    # screen is np.array of screen points (P, 3) for non-local interference, or of their unit
+    # directions (P, 3) for local interference, the output is np.array of shape (P, L).
+    def ordinaryIntensity(self, screen, position_S1, position_S2, wavelength, source_intensity):
         enhance_factor = 1e3
+        wavenumber = (10 ** 7) * 2 * math.pi / wavelength    # wavelength is in nm=10^{-7}cm
 
         if not self.islocalInterference:
-            image_list = self.getImageSourceList()       # get imformation of image-source-pair
-            screen = self.screen                          # get point list of screen
-            pattern = []
-            positionList = image_list.copy()
-            for point in screen:
-                for coherentSource in positionList:         # calculate for each source-screenPoint combination
-                    islocalCorrelate = coherentSource[0]
-                    
-                    # for non-correlate source (ordinary source)
-                    if not islocalCorrelate:
-                        islocalCorrelate, point1, point2, wavelength, source_intensity = coherentSource
-
-                        # calculate interval between source and screen straightly, using them to derive phase difference
-                        interval1 = self.getInterval(point1, point)
-                        interval2 = self.getInterval(point2, point)
-                        delta = (10 ** 7) * 2 * math.pi * (interval1 - interval2) \
-                                    / wavelength    # derive phase differnce, wavelength is in nm=10^{-7}cm
+            # calculate interval between source and screen straightly, once for the whole spectrum
+            interval1 = self.getIntervalArray(screen, position_S1[np.newaxis])[:, 0]
+            interval2 = self.getIntervalArray(screen, position_S2[np.newaxis])[:, 0]
+            intensity1 = 1/(interval1 ** 2)
+            intensity2 = 1/(interval2 ** 2)
 
-                        intensity1 = 1/(interval1 ** 2)
-                        intensity2 = 1/(interval2 ** 2)
-                        intensity = intensity1 + intensity2 + \
-                                    2 * math.sqrt(intensity1 * intensity2) * math.cos(delta)
-                        # forming one term, not interfere with others
-                        pattern.append([point, wavelength, intensity*source_intensity*enhance_factor])
-                    # for correlate source (i.e. with 4 correlated subsource around)
-                    else:
-                        wavelength = coherentSource[1]
-                        
-                        # calculate sum of amplitude, use 2-element array
-                        correlatelist = coherentSource[2:]
-                        point1, source_intensity1 = correlatelist[0]
-                        interval1 = self.getInterval(point1, point)
-                        amplitude = np.array([0.0, 0.0])
-                        for imagesource in correlatelist:
-                            point2, source_intensity2 = imagesource
-                            source_amplitude = math.sqrt(source_intensity2)
-                            interval2 = self.getInterval(point2, point)
-                            delta = (10 ** 7) * 2 * math.pi * (interval1 - interval2) \
-                                    / wavelength    # derive phase differnce, wavelength is in nm=10^{-7}cm
-                            
-                            amplitude += np.array([source_amplitude * math.cos(delta), source_amplitude * math.sin(delta)])
-                        
-                        # calculate intensity
-                        intensity = np.linalg.norm(amplitude) ** 2
-                        
-                        # forming one term, not interfere with others
-                        pattern.append([point, wavelength, intensity*source_intensity1*enhance_factor])
-            return pattern
+            # only the phase difference is evaluated per wavelength
+            delta = np.multiply.outer(interval1 - interval2, wavenumber)    # derive phase differnce
+            intensity = (intensity1 + intensity2)[:, np.newaxis] + \
+                        2 * np.sqrt(intensity1 * intensity2)[:, np.newaxis] * np.cos(delta)
+            return intensity * source_intensity * enhance_factor
         else:
-            raise Exception('Mode is local interference now, please change mode')
-    
-    # This is the interference pattern calculation for local interference.
-    # The output is a list, and the term is like '[position on screen, wavelength, intensity]'
-    def localInterference(self):
-        if self.islocalInterference:
-            image_list = self.getImageSourceList()       # get imformation of image-source-pair
-            screen = self.screen                          # get point list of screen
-            pattern = []
-            positionList = image_list.copy()
-            for point in screen:
-                for coherentSource in positionList:         # calculate for each source-screenPoint combination
-                    islocalCorrelate = coherentSource[0]
-                    
-                    # for non-correlate source (ordinary source)
-                    if not islocalCorrelate:
-                        islocalCorrelate, point1, point2, wavelength, source_intensity = coherentSource
-                        intervalVector = point1 - point2      # derive vector from one coherent image source to the other
+            intervalVector = position_S1 - position_S2      # derive vector from one coherent image source to the other
 
-                        # since specified screenPoint gives a pair of parallel light, 
-                        # we follow screenPoint-lightDirection-phaseDifference calculation, 
-                        # type(point) == np.ndarray, and the term denotes relative distance.
-                        direction = np.array(point)
-                        delta = (10 ** 7) * 2 * math.pi * np.inner(intervalVector, direction) / np.linalg.norm(direction) \
-                                    / wavelength     # derive phase differnce, wavelength is in nm=10^{-7}cm
+            # since specified screenPoint gives a pair of parallel light, 
+            # we follow screenPoint-lightDirection-phaseDifference calculation, 
+            # path difference once for the whole spectrum, phase difference per wavelength
+            delta = np.multiply.outer(np.inner(screen, intervalVector), wavenumber)
+            intensity = 2 + 2 * np.cos(delta)
+            return intensity * source_intensity
+    
+    # Intensity of a correlated source on every screen point, for each of its spectral lines.
+    # The fields of all 2K image sources are added up as one complex-exponential reduction over
+    # (screen points x image sources), a chunk of screen points at a time so that each temporary
+    # array takes about max_bytes; screen and the output are the same as ordinaryIntensity.
+    def correlatedIntensity(self, screen, positions, relative_intensity, wavelength, source_intensity, max_bytes=2 ** 24):
+        enhance_factor = 1e3
+        wavenumber = (10 ** 7) * 2 * math.pi / wavelength    # wavelength is in nm=10^{-7}cm
+        source_amplitude = np.sqrt(relative_intensity)
 
-                        intensity = 2 + 2 * math.cos(delta)
-                        # forming one term, not interfere with others
-                        pattern.append([point, wavelength, intensity*source_intensity])
-                    # for correlate source (i.e. with 4 correlated subsource around)
-                    else:
-                        wavelength = coherentSource[1]
-                        
-                        # calculate sum of amplitude, use 2-element array
-                        correlatelist = coherentSource[2:]
-                        point1, source_intensity1 = correlatelist[0]
-                        amplitude = np.array([0.0, 0.0])
-                        for correlate in correlatelist:
-                            point2, source_intensity2 = correlate
-                            source_amplitude = math.sqrt(source_intensity2)
-                            intervalVector = point1 - point2      # derive vector from one coherent image source to the other
+        intensity = np.zeros((len(screen), np.size(wavelength)))
+        chunk = max(1, int(max_bytes // (16 * len(positions) * max(np.size(wavelength), 1))))
+        for start in range(0, len(screen), chunk):
+            points = screen[start:start + chunk]
+            if not self.islocalInterference:
+                # path difference to the reference image source, straightly from the intervals
+                interval = self.getIntervalArray(points, positions)
+                pathDifference = interval[:, :1] - interval
+            else:
+                # path difference of parallel light, in the direction of each screen point
+                pathDifference = np.inner(points, positions[0] - positions)
 
-                            # since specified screenPoint gives a pair of parallel light, 
-                            # we follow screenPoint-lightDirection-phaseDifference calculation, 
-                            # type(point) == np.ndarray, and the term denotes relative distance.
-                            direction = np.array(point)
-                            delta = (10 ** 7) * 2 * math.pi * np.inner(intervalVector, direction) / np.linalg.norm(direction) \
-                                        / wavelength     # derive phase differnce, wavelength is in nm=10^{-7}cm
+            # complex field, summed over image sources, for each point and wavelength
+            delta = np.multiply.outer(pathDifference, wavenumber)        # (points, image sources, wavelengths)
+            amplitude = np.einsum('pkl,k->pl', np.exp(1j * delta), source_amplitude)
+            intensity[start:start + chunk] = amplitude.real ** 2 + amplitude.imag ** 2
 
-                            amplitude += np.array([source_amplitude * math.cos(delta), source_amplitude * math.sin(delta)])
+        # the field is sqrt(source intensity) times the sum, and the result is weighted by the source intensity again
+        intensity *= source_intensity ** 2
+        if not self.islocalInterference:
+            intensity *= enhance_factor
+        return intensity
+    
+    # Intensity of one entry of the image source list on the screen points, the output is
+    # np.array of shape (P, N) for the N spectral lines of the source
+    def sourceIntensity(self, screen, coherentSource):
+        if not coherentSource[0]:
+            _, point1, point2, wavelength, source_intensity = coherentSource
+            return self.ordinaryIntensity(screen, point1, point2, wavelength, source_intensity)
+        _, wavelength, source_intensity, positions, relative_intensity = coherentSource
+        return self.correlatedIntensity(screen, positions, relative_intensity, wavelength, source_intensity)
+    
+    # Intensity on some of the screen points in the current interference mode, points is an index array
+    # or a slice into the screen points (all of them by default), e.g. one tile of the screen.
+    # The output is '(intensity, wavelengths)', where intensity is np.array of shape (P, C)
+    # and 'wavelengths' are the L distinct wavelengths; each point is computed independently of the others.
+    # output selects the C channels, the same as for simulation.MichelsonSimulation: 'spectrum' (C = L),
+    # 'xyz' or 'total'. For the latter two each source is reduced as soon as it is computed, so
+    # only one source's spectral lines are held at a time.
+    def screenIntensity(self, points=slice(None), output='spectrum'):
+        with profiling.record():
+            with profiling.stage('image sources'):
+                image_list = self.getImageSourceList()       # get imformation of image-source-pair
+                wavelength_list, _, columns = self.getSpectralLines(image_list)
+            if self.islocalInterference:
+                screen = self.screen.getDirections(points)
+            else:
+                screen = self.screen.getPoints(points)
+            profiling.count('evaluations', len(screen) * np.size(wavelength_list))
 
-                        # calculate intensity
-                        intensity = np.linalg.norm(amplitude) ** 2
+            if output == 'spectrum':
+                intensity = np.zeros((len(screen), np.size(wavelength_list)))
+                for column, coherentSource in zip(columns, image_list):     # calculate for each source, on all screen points
+                    with profiling.stage('interference'):
+                        intensity[:, column] = self.sourceIntensity(screen, coherentSource)
+                with profiling.stage('reduction'):
+                    return groupByWavelength(intensity, wavelength_list)
 
-                        # forming one term, not interfere with others
-                        pattern.append([point, wavelength, intensity*source_intensity1])
-            return pattern
+            wavelengths = np.unique(wavelength_list)
+            intensity = np.zeros((len(screen), getChannelCount(wavelengths, output)))
+            for column, coherentSource in zip(columns, image_list):
+                with profiling.stage('interference'):
+                    values = self.sourceIntensity(screen, coherentSource)
+                with profiling.stage('reduction'):
+                    intensity += reduceSpectralLines(values, wavelength_list[column], output)
+            return intensity, wavelengths
+    
+    # This is the interference pattern calculation for non-local interference.
+    # The output is a PatternResult, holding the intensity as an array of shape (H, W, L)
+    # for L distinct wavelengths; iterating over it gives terms like '[position on screen, wavelength, intensity]'.
+    # Since no interference between different source, we compute each source-screenPoint combination,
+    # and get final pattern by simply adding intensities of sources with the same wavelength.
+    def nonlocalInterference(self):
+        if not self.islocalInterference:
+            screen = self.screen                          # get screen, its points are np.array of shape (P, 3)
+            intensity, wavelengths = self.screenIntensity()
+            return PatternResult(intensity.reshape(screen.shape + (-1,)), screen.points.reshape(screen.shape + (3,)), wavelengths)
+        else:
+            raise Exception('Mode is local interference now, please change mode')
+    
+    # This is the interference pattern calculation for local interference.
+    # The output is a PatternResult, the same as nonlocalInterference.
+    def localInterference(self):
+        if self.islocalInterference:
+            screen = self.screen                          # get screen, its points are np.array of shape (P, 3)
+            intensity, wavelengths = self.screenIntensity()
+            return PatternResult(intensity.reshape(screen.shape + (-1,)), screen.points.reshape(screen.shape + (3,)), wavelengths)
         else:
             raise Exception('Mode is nonlocal interference now, please change mode')
-            
\ No newline at end of file
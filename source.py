@@ -0,0 +1,180 @@
+import numpy as np
+
+class SpectralSource:
+    """A class representing a point light source with a discrete spectrum.
+
+    The source sits at one position and emits a set of wavelengths (in nm),
+    each with its own intensity. A monochromatic source is just a spectral
+    source with a single line, so the geometry of the source (its image
+    sources and their distances to the screen) only has to be computed
+    once for the whole spectrum.
+
+    """
+
+    def __init__(self, position, wavelengths, intensities):
+        """Initialise the SpectralSource object.
+
+        position is a 3-vector, wavelengths and intensities are scalars or
+        1-d arrays of the same length.
+
+        """
+
+        self.position = np.array(position, dtype=float)
+        self.wavelengths = np.atleast_1d(np.array(wavelengths, dtype=float))
+        self.intensities = np.atleast_1d(np.array(intensities, dtype=float))
+        if self.wavelengths.shape != self.intensities.shape:
+            raise ValueError('wavelengths and intensities must have the same length')
+
+    def __len__(self):
+        return np.size(self.wavelengths)
+
+    def __repr__(self):
+        return 'SpectralSource(position={}, {} wavelength(s))'.format(self.position.tolist(), len(self))
+
+class CorrelatedSource(SpectralSource):
+    """A class representing a partially coherent (spatially correlated) source.
+
+    The source is made of K sub-sources around its position, given by their
+    offsets and relative intensities (weights). The sub-sources are mutually
+    coherent, so their fields are added before taking the intensity. The
+    first sub-source is the reference of the phase.
+
+    Use CorrelatedSource.cross for the classic centre plus 4 sub-sources,
+    or CorrelatedSource.disk / CorrelatedSource.gaussian to sample K
+    sub-sources with a reproducible seed.
+
+    """
+
+    def __init__(self, position, wavelengths, intensities, offsets, weights):
+        """Initialise the CorrelatedSource object.
+
+        offsets has shape (K, 3), in cm relative to position, and weights
+        has shape (K,); the rest is the same as for SpectralSource.
+
+        """
+
+        SpectralSource.__init__(self, position, wavelengths, intensities)
+        self.offsets = np.array(offsets, dtype=float).reshape(-1, 3)
+        self.weights = np.array(weights, dtype=float).reshape(-1)
+        if len(self.offsets) != len(self.weights) or len(self.weights) == 0:
+            raise ValueError('offsets and weights must describe the same (non-zero) number of sub-sources')
+
+    @classmethod
+    def cross(cls, position, wavelengths, intensities, spacing=0.5, weight=0.1):
+        """The centre plus 4 sub-sources at +-spacing along y and z."""
+        offsets = [[0, 0, 0], [0, -spacing, 0], [0, spacing, 0], [0, 0, spacing], [0, 0, -spacing]]
+        return cls(position, wavelengths, intensities, offsets, [1, weight, weight, weight, weight])
+
+    @classmethod
+    def disk(cls, position, wavelengths, intensities, radius, n_subsources, seed=None, axes=((0, 1, 0), (0, 0, 1))):
+        """K sub-sources sampled uniformly on a disk of the given radius.
+
+        The disk lies in the plane spanned by axes (the y-z plane by
+        default, facing mirror G). All sub-sources have the same weight,
+        normalised so that the fully coherent limit keeps the intensity of
+        a single point source.
+
+        """
+
+        rng = np.random.default_rng(seed)
+        r = radius * np.sqrt(rng.random(n_subsources))
+        theta = 2 * np.pi * rng.random(n_subsources)
+        return cls._fromPlane(position, wavelengths, intensities, r * np.cos(theta), r * np.sin(theta), axes)
+
+    @classmethod
+    def gaussian(cls, position, wavelengths, intensities, sigma, n_subsources, seed=None, axes=((0, 1, 0), (0, 0, 1))):
+        """K sub-sources sampled from a 2-d Gaussian of width sigma, see disk."""
+        rng = np.random.default_rng(seed)
+        u, v = sigma * rng.standard_normal((2, n_subsources))
+        return cls._fromPlane(position, wavelengths, intensities, u, v, axes)
+
+    @classmethod
+    def _fromPlane(cls, position, wavelengths, intensities, u, v, axes):
+        axis_u, axis_v = np.array(axes, dtype=float)
+        offsets = np.multiply.outer(u, axis_u) + np.multiply.outer(v, axis_v)
+        n_subsources = np.size(u)
+        return cls(position, wavelengths, intensities, offsets, np.full(n_subsources, 1 / n_subsources ** 2))
+
+    @property
+    def subsourcePositions(self):
+        """Positions of the sub-sources, shape (K, 3)."""
+        return self.position + self.offsets
+
+    def __repr__(self):
+        return 'CorrelatedSource(position={}, {} wavelength(s), {} sub-source(s))'.format(
+            self.position.tolist(), len(self), len(self.weights))
+
+class ExtendedSource(SpectralSource):
+    """A class representing an incoherent extended source, e.g. a lamp.
+
+    Every point of the source emits independently of the others, so its
+    pattern is the average of the patterns of point sources drawn over its
+    area, each with the full spectrum. The samples are drawn from a disk,
+    a rectangle or a 2-d Gaussian around position, in the plane spanned by
+    axes (the y-z plane by default, facing mirror G).
+
+    Samples are drawn in a fixed order from seed, so the first n samples
+    are always the same, however many batches they are drawn in. An
+    ordinary render uses the first n_samples of them, while
+    MichelsonSimulation.convergedInterference draws batches until the
+    pattern converges. A seed of None is replaced by a fresh random seed,
+    kept in seed, so that the samples of a source stay the same between
+    renders (and RenderCache keys stay reproducible).
+
+    """
+
+    shapes = ('disk', 'rectangle', 'gaussian')
+
+    def __init__(self, position, wavelengths, intensities, shape, extent, n_samples=64, seed=0,
+                 axes=((0, 1, 0), (0, 0, 1))):
+        """Initialise the ExtendedSource object.
+
+        shape is one of 'disk', 'rectangle' and 'gaussian', and extent is
+        its radius, its (height, width) along axes or its sigma, in cm.
+        The rest is the same as for SpectralSource.
+
+        """
+
+        SpectralSource.__init__(self, position, wavelengths, intensities)
+        if shape not in self.shapes:
+            raise ValueError('shape must be one of {}'.format(self.shapes))
+        if int(n_samples) < 1:
+            raise ValueError('n_samples must be positive')
+        self.shape = shape
+        self.extent = np.array(extent, dtype=float)
+        self.n_samples = int(n_samples)
+        self.seed = np.random.SeedSequence().entropy if seed is None else seed
+        self.axes = np.array(axes, dtype=float)
+
+    @classmethod
+    def disk(cls, position, wavelengths, intensities, radius, n_samples=64, seed=0, axes=((0, 1, 0), (0, 0, 1))):
+        """A uniform disk of the given radius."""
+        return cls(position, wavelengths, intensities, 'disk', radius, n_samples, seed, axes)
+
+    @classmethod
+    def rectangle(cls, position, wavelengths, intensities, size, n_samples=64, seed=0, axes=((0, 1, 0), (0, 0, 1))):
+        """A uniform rectangle of the given (height, width)."""
+        return cls(position, wavelengths, intensities, 'rectangle', size, n_samples, seed, axes)
+
+    @classmethod
+    def gaussian(cls, position, wavelengths, intensities, sigma, n_samples=64, seed=0, axes=((0, 1, 0), (0, 0, 1))):
+        """A 2-d Gaussian profile of width sigma."""
+        return cls(position, wavelengths, intensities, 'gaussian', sigma, n_samples, seed, axes)
+
+    def samplePositions(self, start, stop):
+        """Positions of the samples start to stop-1, shape (stop - start, 3)."""
+        rng = np.random.default_rng(self.seed)
+        if self.shape == 'gaussian':
+            u, v = (self.extent * rng.standard_normal((stop, 2))[start:]).T
+        else:
+            draws = rng.random((stop, 2))[start:]
+            if self.shape == 'disk':
+                r, theta = self.extent * np.sqrt(draws[:, 0]), 2 * np.pi * draws[:, 1]
+                u, v = r * np.cos(theta), r * np.sin(theta)
+            else:
+                u, v = ((draws - 0.5) * self.extent).T
+        return self.position + np.multiply.outer(u, self.axes[0]) + np.multiply.outer(v, self.axes[1])
+
+    def __repr__(self):
+        return 'ExtendedSource(position={}, {} wavelength(s), {} {}, {} sample(s))'.format(
+            self.position.tolist(), len(self), self.shape, self.extent.tolist(), self.n_samples)
@@ -0,0 +1,59 @@
+import numpy as np
+
+from simulation import spec_wavelengths
+
+'''
+    Fourier-transform spectroscopy with the detector mode of MichelsonSimulation.
+
+    While mirror M1 scans, a detector sees I(x) = sum over lines of I_k * (1 + cos(2*pi*x/lambda_k)),
+    up to geometry factors, where x is the optical path difference. The spectrum is recovered as the
+    amplitude of the cosine at each wavenumber 1/lambda, from the FFT of the interferogram.
+
+    For a detector on the axis of arm M1 in local interference, moving M1 by d changes the path
+    difference by 2*d, so path_difference = 2 * displacements. To resolve the 5 nm grid of
+    spec_wavelengths the scan must cover a path difference of a few 1/200 cm (some 100 um), and
+    the path difference step must stay below lambda/2 = 190 nm for the shortest wavelength.
+
+    Example:
+        displacements = np.arange(16384) * 50e-7            # 50 nm steps of M1, in cm
+        interferogram = simulation.detectorInterferogram([0, -2, 0], displacements)[:, 0]
+        spectrum = recoverSpectrum(interferogram, 2 * displacements)
+'''
+
+'''
+    Recover the spectrum from an interferogram, (F,) or (F, D) for D detectors, sampled at
+    the uniformly spaced path differences (F,) in cm. The output is the amplitude of the
+    cosine of every wavelength of wavelengths (in nm, spec_wavelengths by default),
+    with shape (len(wavelengths),) or (len(wavelengths), D).
+
+    The mean is removed and a Hann window is applied against the leakage of lines that fall
+    between frequency bins, then the interferogram is zero-padded (padding times, rounded up to
+    a power of 2) so that the FFT bins are fine enough to be interpolated at 1/wavelength.
+    A line with the cosine amplitude A gives about A at its wavelength, but wavelengths closer
+    than the resolution 1/(path difference range) share the amplitude of their neighbours.
+'''
+def recoverSpectrum(interferogram, path_difference, wavelengths=spec_wavelengths, padding=4):
+    interferogram = np.asarray(interferogram, dtype=float)
+    path_difference = np.ravel(np.asarray(path_difference, dtype=float))
+    n_samples = len(path_difference)
+    if np.shape(interferogram)[0] != n_samples:
+        raise ValueError('interferogram and path_difference must have the same number of samples')
+    if n_samples < 2:
+        raise ValueError('at least 2 samples are needed')
+    step = (path_difference[-1] - path_difference[0]) / (n_samples - 1)
+    if step == 0 or not np.allclose(np.diff(path_difference), step, rtol=1e-6, atol=0):
+        raise ValueError('path_difference must be uniformly spaced')
+
+    window = np.hanning(n_samples).reshape((-1,) + (1,) * (interferogram.ndim - 1))
+    signal = (interferogram - interferogram.mean(axis=0)) * window
+    n_fft = 1 << int(np.ceil(np.log2(n_samples * padding)))
+    amplitude = 2 * np.abs(np.fft.rfft(signal, n=n_fft, axis=0)) / window.sum()
+    frequency = np.fft.rfftfreq(n_fft, d=abs(step))          # wavenumbers in 1/cm
+
+    target = 1e7 / np.asarray(wavelengths, dtype=float)       # wavelength is in nm=10^{-7}cm
+    if target.max() > frequency[-1]:
+        raise ValueError('the path difference step is too large for the shortest wavelength (aliasing)')
+    if interferogram.ndim == 1:
+        return np.interp(target, frequency, amplitude)
+    return np.stack([np.interp(target, frequency, column) for column in amplitude.reshape(len(frequency), -1).T],
+                    axis=-1).reshape((len(target),) + interferogram.shape[1:])
@@ -1,35 +1,129 @@
 from __future__ import unicode_literals
 import random
 import numpy as np
-import matplotlib.pyplot as plt
+import profiling
 from colour_system import cs_hdtv
-from simulation import spec_wavelengths
+from cache import getSceneKey
+from pattern import reduceSpectralLines
 
 
 '''
-    This function calculates RGB map from simulation pattern
+    This function calculates RGB map from simulation pattern (a PatternResult)
 '''
 def RGBConverter(pattern):
-    wavelength_arr = np.array([entry[1] for entry in pattern]).reshape(100,100,-1)[0,0,:]
-    intensity_arr = np.array([entry[2] for entry in pattern]).reshape(100,100,-1)
-    
-    spec_map = np.zeros((100,100,np.size(spec_wavelengths)))
-    
-    for i in range(np.size(wavelength_arr)):
-        idx = int((wavelength_arr[i]-380)/5)
-        if 0<=idx<np.size(spec_wavelengths):
-            spec_map[:,:,idx] += intensity_arr[:,:,i]
-        
-    return np.apply_along_axis(cs_hdtv.spec_to_rgb, axis=2, arr=spec_map)
-
-def showPattern(ax, simulation, is_colored=False):
-    if simulation.islocalInterference:
-        pattern = simulation.localInterference()
-    else:
-        pattern = simulation.nonlocalInterference()
-    
+    with profiling.stage('reduction'):
+        xyz = cs_hdtv.lines_to_xyz(pattern.wavelengths, pattern.intensity)
+    with profiling.stage('colour conversion'):
+        return cs_hdtv.xyz_to_rgb_array(xyz)
+
+'''
+    This function calculates the image to show for simulation, an (H, W, 3) RGB map
+    if is_colored, else the (H, W) total intensity; it does not touch matplotlib,
+    so it can run in a worker thread. The simulation accumulates only the 3 tristimulus
+    channels (or the total) per pixel, without building the per-wavelength pattern.
+    With a cache (a cache.RenderCache), the result is looked up there first.
+    With profiling enabled, profiling.getLastStats() then gives the timings of the call.
+'''
+def renderImage(simulation, is_colored=False, cache=None):
+    output = 'xyz' if is_colored else 'total'
+    with profiling.record():
+        if cache is not None:
+            values, _ = cache.screenIntensity(simulation, output)
+        else:
+            values, _ = simulation.screenIntensity(output=output)
+        return channelsToImage(values.reshape(simulation.screen.shape + (-1,)), is_colored)
+
+def channelsToImage(values, is_colored=False):
     if is_colored:
-        ax.imshow(RGBConverter(pattern), interpolation='none')
+        with profiling.stage('colour conversion'):
+            return cs_hdtv.xyz_to_rgb_array(values)
     else:
-        ax.imshow(np.array([entry[2] for entry in pattern]).reshape(100,100,-1).sum(axis=2))
+        return values[:, :, 0]
+
+'''
+    This function renders simulation progressively, yielding one image (as renderImage)
+    per stride in strides: first the screen points on a coarse grid (every 4th row and column
+    by default, i.e. 25*25 of 100*100), each filling its block of pixels, then finer grids.
+    The grids nest, so every pass only computes the points not computed before,
+    and the final pass (stride 1) gives the full-resolution image.
+    With a cache (a cache.RenderCache), a cached pattern is yielded at once as the only image,
+    otherwise the full-resolution result is cached after the final pass.
+    Every pass is recorded on its own for profiling (see profiling.getLastStats).
+'''
+def renderProgressive(simulation, is_colored=False, strides=(4, 1), cache=None):
+    screen = simulation.screen
+    height, width = screen.shape
+    output = compute_output = 'xyz' if is_colored else 'total'
+    if cache is not None:
+        key = getSceneKey(simulation)
+        cached = cache.lookup(simulation, output, key)
+        if cached is not None:
+            with profiling.record():
+                image = channelsToImage(cached[0].reshape(height, width, -1), is_colored)
+            yield image
+            return
+        _, wavelengths = simulation.screenIntensity(slice(0, 0))
+        compute_output = cache.getComputeOutput(wavelengths, output)
+    intensity = None
+    computed = np.zeros(height * width, dtype=bool)
+
+    for stride in strides:
+        with profiling.record():
+            rows, columns = np.arange(0, height, stride), np.arange(0, width, stride)
+            points = (rows[:, np.newaxis] * width + columns[np.newaxis, :]).ravel()
+            points = points[~computed[points]]
+            values, wavelengths = simulation.screenIntensity(points, output=compute_output)
+            if intensity is None:
+                intensity = np.zeros((height * width, np.shape(values)[1]))
+            intensity[points] = values
+            computed[points] = True
+
+            # every pixel takes the value of the nearest computed point above and left of it
+            nearest = ((np.arange(height) // stride * stride)[:, np.newaxis] * width
+                       + (np.arange(width) // stride * stride)[np.newaxis, :])
+            if cache is not None and np.all(computed):
+                cache.put(key, compute_output, intensity, wavelengths)
+            image = channelsToImage(reduceSpectralLines(intensity[nearest], wavelengths, output)
+                                    if compute_output != output else intensity[nearest], is_colored)
+        yield image
+
+'''
+    This function shows image on ax and returns its AxesImage; if an AxesImage from an
+    earlier call is given as artist, only its pixel buffer (and color limits) is updated
+    with set_data instead of creating a new one, the caller then redraws the canvas
+'''
+def showImage(ax, image, is_colored=False, artist=None):
+    import matplotlib    # only needed for display, so compute-only users never import it
+    with profiling.stage('drawing'):
+        if artist is None:
+            if is_colored:
+                return ax.imshow(image, interpolation='none')
+            else:
+                return ax.imshow(image)
+
+        height, width = np.shape(image)[:2]
+        if np.shape(artist.get_array())[:2] != (height, width):
+            artist.set_extent((-0.5, width - 0.5, height - 0.5, -0.5))
+        artist.set_data(image)
+        artist.set_interpolation('none' if is_colored else matplotlib.rcParams['image.interpolation'])
+        if not is_colored:
+            artist.set_clim(np.min(image), np.max(image))
+        return artist
+
+'''
+    This function shows the pattern of simulation on ax and returns its AxesImage, see showImage.
+    With progressive=True, a coarse preview is drawn first and refined to full resolution
+    (see renderProgressive), redrawing the canvas after each pass. A cache is used as in renderImage.
+    With profiling enabled, profiling.getLastStats() then gives the timings of the whole call.
+'''
+def showPattern(ax, simulation, is_colored=False, artist=None, progressive=False, cache=None):
+    with profiling.record():
+        if not progressive:
+            return showImage(ax, renderImage(simulation, is_colored, cache), is_colored, artist)
 
+        for image in renderProgressive(simulation, is_colored, cache=cache):
+            artist = showImage(ax, image, is_colored, artist)
+            with profiling.stage('drawing'):
+                ax.figure.canvas.draw_idle()
+                ax.figure.canvas.flush_events()
+        return artist